@@ -1,59 +1,23 @@
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for
+from flask import Flask, Response, render_template, jsonify, request, session, redirect, url_for
 import logging
 import platform
 import socket
-import requests
 from datetime import datetime
-import math
 import re
 import json
 import os
-
-# WGS-84转GCJ-02坐标转换函数
-def wgs84_to_gcj02(lng, lat):
-    """将WGS-84坐标转换为GCJ-02坐标"""
-    PI = math.pi
-    a = 6378137.0
-    ee = 0.00669342162296594323
-    
-    if out_of_china(lng, lat):
-        return lng, lat
-    
-    d_lat = transform_lat(lng - 105.0, lat - 35.0)
-    d_lng = transform_lng(lng - 105.0, lat - 35.0)
-    rad_lat = lat / 180.0 * PI
-    magic = math.sin(rad_lat)
-    magic = 1 - ee * magic * magic
-    sqrt_magic = math.sqrt(magic)
-    d_lat = (d_lat * 180.0) / ((a * (1 - ee)) / (magic * sqrt_magic) * PI)
-    d_lng = (d_lng * 180.0) / (a / sqrt_magic * math.cos(rad_lat) * PI)
-    
-    gcj_lat = lat + d_lat
-    gcj_lng = lng + d_lng
-    
-    return gcj_lng, gcj_lat
-
-def transform_lat(x, y):
-    """计算纬度偏移量"""
-    PI = math.pi
-    ret = -100.0 + 2.0 * x + 3.0 * y + 0.2 * y * y + 0.1 * x * y + 0.2 * math.sqrt(abs(x))
-    ret += (20.0 * math.sin(6.0 * x * PI) + 20.0 * math.sin(2.0 * x * PI)) * 2.0 / 3.0
-    ret += (20.0 * math.sin(y * PI) + 40.0 * math.sin(y / 3.0 * PI)) * 2.0 / 3.0
-    ret += (160.0 * math.sin(y / 12.0 * PI) + 320 * math.sin(y * PI / 30.0)) * 2.0 / 3.0
-    return ret
-
-def transform_lng(x, y):
-    """计算经度偏移量"""
-    PI = math.pi
-    ret = 300.0 + x + 2.0 * y + 0.1 * x * x + 0.1 * x * y + 0.1 * math.sqrt(abs(x))
-    ret += (20.0 * math.sin(6.0 * x * PI) + 20.0 * math.sin(2.0 * x * PI)) * 2.0 / 3.0
-    ret += (20.0 * math.sin(x * PI) + 40.0 * math.sin(x / 3.0 * PI)) * 2.0 / 3.0
-    ret += (150.0 * math.sin(x / 12.0 * PI) + 300.0 * math.sin(x / 30.0 * PI)) * 2.0 / 3.0
-    return ret
-
-def out_of_china(lng, lat):
-    """判断坐标是否在国外"""
-    return (lng < 72.004 or lng > 137.8347) or (lat < 0.8293 or lat > 55.8271)
+import atexit
+import signal
+import sys
+import threading
+from log_store import JsonArrayLogStore, JsonlLogStore, SqliteLogStore, SegmentedLogStore, migrate_logs, add_derived_fields, add_derived_fields_many
+from log_writer import BatchLogWriter
+from log_index import SORT_FIELDS, LogIndex, select_page
+from geo_grid import GeoGrid
+from log_events import LogBroadcaster
+from log_codec import ENCODINGS, MIN_COMPRESS_SIZE, compress, encode_columnar
+from ip_database import IPRangeDatabase
+from ip_lookup import HedgedFetcher, IPCache, IPLookup, SqliteIPCache, close_sessions, configure_health, configure_http, get_ip_details
 
 app = Flask(__name__)
 
@@ -61,6 +25,41 @@ app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # 用于session管理
 ADMIN_PASSWORD = 'Pzf75513'  # 管理员密码
 LOG_FILE = 'device_info.json'  # JSON格式日志文件
+JSONL_LOG_FILE = 'device_info.jsonl'  # JSON Lines格式日志文件
+LOG_DB_FILE = 'device_info.db'  # SQLite日志数据库
+LOG_SEGMENT_DIR = 'device_info_segments'  # 分段日志目录
+LOG_SEGMENT_PARTITION = os.environ.get('LOG_SEGMENT_PARTITION', 'day')  # 分段方式：day（按天）或hour（按小时）
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'jsonl')  # 日志存储格式：jsonl（追加写入）、sqlite（索引查询）、segments（按时间分段）或json（旧版数组）
+LOG_WRITE_MODE = os.environ.get('LOG_WRITE_MODE', 'async')  # 写入方式：async（后台线程批量写入）或sync（请求线程内同步写入）
+LOG_FSYNC_POLICY = os.environ.get('LOG_FSYNC_POLICY', 'interval')  # 落盘策略：batch（每批fsync）、interval（定时fsync）或none
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))  # 写入队列容量
+LOG_BATCH_SIZE = int(os.environ.get('LOG_BATCH_SIZE', 200))  # 单批次最多写入条数
+LOG_FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL', 0.2))  # 批次最长等待时间（秒）
+LOG_FSYNC_INTERVAL = float(os.environ.get('LOG_FSYNC_INTERVAL', 1.0))  # interval策略下的fsync间隔（秒）
+LOG_INDEX = os.environ.get('LOG_INDEX', 'on')  # 内存日志索引：on（读接口使用内存索引，增量读取新日志）或off（每次请求读取日志文件）
+LOG_STATS_UNIQUE_IPS = os.environ.get('LOG_STATS_UNIQUE_IPS', 'exact')  # 独立IP统计方式：exact（精确集合）或hll（HyperLogLog近似计数，内存固定约16KB）
+LOG_STREAM_POLL_INTERVAL = float(os.environ.get('LOG_STREAM_POLL_INTERVAL', 1.0))  # 推送连接检查其他工作进程写入的新日志的间隔（秒）
+LOG_PAGE_SIZE = int(os.environ.get('LOG_PAGE_SIZE', 50))  # 后台页面每页显示的日志条数
+LOG_MAX_PAGE_SIZE = int(os.environ.get('LOG_MAX_PAGE_SIZE', 500))  # per_page参数允许的最大值
+GEO_GRID_MAX_PRECISION = int(os.environ.get('GEO_GRID_MAX_PRECISION', 4))  # 访客分布网格的最高精度（geohash位数），默认4位约为城市级别
+IP_CACHE_SIZE = int(os.environ.get('IP_CACHE_SIZE', 10000))  # IP查询结果缓存的最大条数
+IP_CACHE_TTL = float(os.environ.get('IP_CACHE_TTL', 3600))  # IP查询结果缓存时间（秒）
+IP_CACHE_NEGATIVE_TTL = float(os.environ.get('IP_CACHE_NEGATIVE_TTL', 300))  # 所有查询服务都失败时的缓存时间（秒）
+IP_CACHE_DB = os.environ.get('IP_CACHE_DB', 'ip_cache.db')  # 工作进程共享的IP缓存数据库，设为空字符串时不使用
+IP_CACHE_DB_SIZE = int(os.environ.get('IP_CACHE_DB_SIZE', 100000))  # 共享IP缓存的最大条数
+IP_CACHE_DB_TTL = float(os.environ.get('IP_CACHE_DB_TTL', 86400))  # 共享IP缓存中查询结果的缓存时间（秒）
+IP_LOOKUP_MODE = os.environ.get('IP_LOOKUP_MODE', 'hedged')  # 外部查询方式：hedged（对冲并发请求）或sequential（逐个请求）
+IP_LOOKUP_PARALLEL = int(os.environ.get('IP_LOOKUP_PARALLEL', 3))  # hedged模式下同时进行的最大请求数
+IP_LOOKUP_HEDGE_DELAY = float(os.environ.get('IP_LOOKUP_HEDGE_DELAY', 0.3))  # 多久没有结果就再请求下一个服务（秒），0表示同时请求
+IP_LOOKUP_TIMEOUT = float(os.environ.get('IP_LOOKUP_TIMEOUT', 5))  # 单个查询服务的请求超时（秒）
+IP_LOOKUP_POOL_SIZE = int(os.environ.get('IP_LOOKUP_POOL_SIZE', 10))  # 每个查询服务保持的最大连接数
+IP_LOOKUP_RETRIES = int(os.environ.get('IP_LOOKUP_RETRIES', 1))  # 连接失败或网关错误（502/503/504）时的重试次数
+IP_LOOKUP_CONNECT_TIMEOUT = float(os.environ.get('IP_LOOKUP_CONNECT_TIMEOUT', 2))  # 建立连接的超时（秒）
+IP_LOOKUP_BUDGET = float(os.environ.get('IP_LOOKUP_BUDGET', 0.8))  # 请求等待外部查询的时间预算（秒），超出时返回降级结果（查询在后台继续完成并写入缓存），0表示不限制
+IP_LOOKUP_MAX_PENDING = int(os.environ.get('IP_LOOKUP_MAX_PENDING', 64))  # 有时间预算时同时进行的外部查询上限，达到上限时新IP直接返回降级结果
+IP_PROVIDER_FAILURE_THRESHOLD = int(os.environ.get('IP_PROVIDER_FAILURE_THRESHOLD', 5))  # 查询服务连续失败多少次后熔断
+IP_PROVIDER_COOLDOWN = float(os.environ.get('IP_PROVIDER_COOLDOWN', 60))  # 熔断的查询服务多少秒内不再请求
+IP_OFFLINE_DB = os.environ.get('IP_OFFLINE_DB', 'ip_ranges.db')  # 离线IP地址段数据库（python ip_database.py import 生成），文件存在时优先使用
 
 # 科技感后台配置
 TECH_ADMIN_PASSWORD = os.environ.get('TECH_BACKEND_PASSWORD', 'Pzf75513')  # 从环境变量获取密码，默认Pzf75513
@@ -81,241 +80,114 @@ logger = logging.getLogger(__name__)
 werkzeug_logger = logging.getLogger('werkzeug')
 werkzeug_logger.setLevel(logging.INFO)
 
+def get_real_ip(headers, remote_addr):
+    """获取请求者的真实IP，优先检查X-Forwarded-For等代理头"""
+    return headers.get('X-Forwarded-For', '').split(',')[0].strip() or \
+           headers.get('X-Real-IP', '').strip() or \
+           remote_addr
+
+def build_ip_info(real_ip, ip_data, degraded=False):
+    """构建/api/ip-info的返回结果"""
+    return {
+        'public_ip': real_ip,
+        'country': ip_data.get('country', 'N/A'),
+        'region': ip_data.get('region', 'N/A'),
+        'city': ip_data.get('city', 'N/A'),
+        'loc': ip_data.get('loc', 'N/A'),
+        'timezone': ip_data.get('timezone', 'N/A'),
+        'isp': ip_data.get('isp', 'N/A'),
+        'degraded': degraded
+    }
+
 @app.route('/api/ip-info')
 def get_ip_info():
-    def get_ip_details(ip):
-        """获取IP详情的备选方案，使用更可靠的IP地理信息服务"""
-        # 添加更多可靠的IP地理信息服务，按可靠性排序
-        details_services = [
-            # 使用国内更可靠的IP查询服务
-            f'https://whois.pconline.com.cn/ipJson.jsp?ip={ip}&json=true',  # 太平洋网络IP查询
-            f'https://api.vore.top/api/IPdata?ip={ip}',  # 国内IP查询API
-            f'https://ip.useragentinfo.com/json?ip={ip}',  # 国内IP查询服务
-            f'https://api.ipwhois.cn/?ip={ip}&json=true',  # 国内IPWHOIS查询服务
-            f'https://ip-api.com/json/{ip}?lang=zh-CN',  # 国际IP查询API，支持中文
-            # 国际IP查询服务
-            f'https://ipinfo.io/{ip}/json',  # 已经在使用
-            f'https://ipapi.co/{ip}/json/',  # 已经在使用
-            f'https://api.ipgeolocation.io/ipgeo?apiKey=32bcd4a6e4b548968e7afcdb682ac679&ip={ip}',  # 免费API
-            f'https://freeipapi.com/api/json/{ip}',  # 免费IP查询API
-            f'https://api.my-ip.io/v2/ip.json?ip={ip}',  # 已经在使用
-            f'https://api.db-ip.com/v2/free/{ip}'  # DB-IP免费IP查询API
-        ]
-        
-        for service in details_services:
-            try:
-                # 发送请求，增加超时时间到5秒
-                response = requests.get(service, timeout=5)
-                response.raise_for_status()  # 检查请求是否成功
-                
-                # 尝试解析JSON响应
-                data = response.json()
-                
-                # 处理不同API返回的数据格式
-                if service.startswith('https://whois.pconline.com.cn'):
-                    # 太平洋网络IP查询结果处理
-                    if data and isinstance(data, dict):
-                        return {
-                            'ip': ip,
-                            'country': '中国' if data.get('pro') else 'N/A',
-                            'region': data.get('pro', 'N/A'),
-                            'city': data.get('city', 'N/A'),
-                            'loc': f"{data.get('lat', 'N/A')},{data.get('lng', 'N/A')}",
-                            'timezone': data.get('timezone', 'N/A'),
-                            'isp': data.get('isp', 'N/A')
-                        }
-                elif service.startswith('https://api.vore.top'):
-                    # 国内IP查询API结果处理
-                    result = data.get('result', {})
-                    if result == 200:  # 检查API是否返回成功
-                        data = data.get('data', {})
-                        if data and isinstance(data, dict):
-                            return {
-                                'ip': ip,
-                                'country': data.get('country', 'N/A'),
-                                'region': data.get('province', 'N/A'),
-                                'city': data.get('city', 'N/A'),
-                                'loc': f"{data.get('lat', 'N/A')},{data.get('lng', 'N/A')}",
-                                'timezone': data.get('timezone', 'N/A'),
-                                'isp': data.get('isp', 'N/A')
-                            }
-                elif service.startswith('https://ip.useragentinfo.com'):
-                    # 国内IP查询服务结果处理
-                    status = data.get('code', 0)
-                    if status == 200:  # 检查API是否返回成功
-                        data = data.get('data', {})
-                        if data and isinstance(data, dict):
-                            return {
-                                'ip': ip,
-                                'country': data.get('country', 'N/A'),
-                                'region': data.get('region', 'N/A'),
-                                'city': data.get('city', 'N/A'),
-                                'loc': f"{data.get('lat', 'N/A')},{data.get('lng', 'N/A')}",
-                                'timezone': data.get('timezone', 'N/A'),
-                                'isp': data.get('isp', 'N/A')
-                            }
-                elif service.startswith('https://api.ipwhois.cn'):
-                    # 国内IPWHOIS查询服务结果处理
-                    if data and isinstance(data, dict) and data.get('ret') == 'ok':
-                        return {
-                            'ip': ip,
-                            'country': data.get('country', 'N/A'),
-                            'region': data.get('province', 'N/A'),
-                            'city': data.get('city', 'N/A'),
-                            'loc': f"{data.get('lat', 'N/A')},{data.get('lng', 'N/A')}",
-                            'timezone': data.get('timezone', 'N/A'),
-                            'isp': data.get('isp', 'N/A')
-                        }
-                elif service.startswith('https://ip-api.com'):
-                    # IP-API查询结果处理
-                    if data and isinstance(data, dict) and data.get('status') == 'success':
-                        return {
-                            'ip': ip,
-                            'country': data.get('country', 'N/A'),
-                            'region': data.get('regionName', 'N/A'),
-                            'city': data.get('city', 'N/A'),
-                            'loc': f"{data.get('lat', 'N/A')},{data.get('lon', 'N/A')}",
-                            'timezone': data.get('timezone', 'N/A'),
-                            'isp': data.get('isp', 'N/A')
-                        }
-                elif service.startswith('https://api.ipgeolocation.io'):
-                    # ipgeolocation.io结果处理
-                    if data and isinstance(data, dict):
-                        return {
-                            'ip': ip,
-                            'country': data.get('country_name', 'N/A'),
-                            'region': data.get('state_prov', 'N/A'),
-                            'city': data.get('city', 'N/A'),
-                            'loc': f"{data.get('latitude', 'N/A')},{data.get('longitude', 'N/A')}",
-                            'timezone': data.get('time_zone', {}).get('name', 'N/A'),
-                            'isp': data.get('isp', 'N/A')
-                        }
-                elif service.startswith('https://freeipapi.com'):
-                    # freeipapi.com结果处理
-                    if data and isinstance(data, dict):
-                        return {
-                            'ip': ip,
-                            'country': data.get('countryName', 'N/A'),
-                            'region': data.get('regionName', 'N/A'),
-                            'city': data.get('cityName', 'N/A'),
-                            'loc': f"{data.get('latitude', 'N/A')},{data.get('longitude', 'N/A')}",
-                            'timezone': data.get('timeZone', 'N/A'),
-                            'isp': data.get('isp', 'N/A')
-                        }
-                elif service.startswith('https://api.db-ip.com'):
-                    # DB-IP免费IP查询API结果处理
-                    if data and isinstance(data, dict):
-                        return {
-                            'ip': ip,
-                            'country': data.get('countryName', 'N/A'),
-                            'region': data.get('stateProv', 'N/A'),
-                            'city': data.get('city', 'N/A'),
-                            'loc': f"{data.get('latitude', 'N/A')},{data.get('longitude', 'N/A')}",
-                            'timezone': data.get('timeZone', 'N/A'),
-                            'isp': data.get('isp', 'N/A')
-                        }
-                elif service.startswith('https://ipinfo.io') or service.startswith('https://ipapi.co'):
-                    # 其他国际IP查询服务结果处理
-                    if data and isinstance(data, dict):
-                        return data
-                else:
-                    # 其他API结果处理
-                    if data and isinstance(data, dict):
-                        return data
-                
-                # 如果当前服务的响应格式不符合预期，继续尝试下一个服务
-                continue
-            except requests.RequestException as e:
-                # 记录请求异常，但不中断循环
-                logger.debug(f"IP service {service} failed: {e}")
-                continue
-            except ValueError as e:
-                # 记录JSON解析异常，但不中断循环
-                logger.debug(f"JSON parsing failed for {service}: {e}")
-                continue
-            except Exception as e:
-                # 记录其他异常，但不中断循环
-                logger.debug(f"Unexpected error for {service}: {e}")
-                continue
-        return {}
-    
     try:
         # 获取请求者的真实IP
-        # 优先检查X-Forwarded-For等代理头
-        real_ip = request.headers.get('X-Forwarded-For', '').split(',')[0].strip() or \
-                 request.headers.get('X-Real-IP', '').strip() or \
-                 request.remote_addr
+        real_ip = get_real_ip(request.headers, request.remote_addr)
         
-        # 获取IP详情
-        ip_data = get_ip_details(real_ip)
+        # 获取IP详情，超出时间预算时返回降级结果
+        ip_data, degraded = ip_lookup.resolve(real_ip)
         
         # 构建返回结果
-        result = {
-            'public_ip': real_ip,
-            'country': ip_data.get('country', 'N/A'),
-            'region': ip_data.get('region', 'N/A'),
-            'city': ip_data.get('city', 'N/A'),
-            'loc': ip_data.get('loc', 'N/A'),
-            'timezone': ip_data.get('timezone', 'N/A'),
-            'isp': ip_data.get('org', ip_data.get('isp', 'N/A'))
-        }
+        result = build_ip_info(real_ip, ip_data, degraded)
         
-        return jsonify(result)
+        response = jsonify(result)
+        if degraded:
+            response.headers['X-IP-Lookup-Degraded'] = '1'
+        return response
     except Exception as e:
         logger.error(f"Error getting IP info: {e}")
         # 即使IP获取失败，也返回可用的信息
-        return jsonify({
-            'public_ip': request.remote_addr,  # 至少返回本地IP
-            'country': 'N/A',
-            'region': 'N/A',
-            'city': 'N/A',
-            'loc': 'N/A',
-            'timezone': 'N/A',
-            'isp': 'N/A'
-        })
+        return jsonify(build_ip_info(request.remote_addr, {}, degraded=True))  # 至少返回本地IP
+
+# 初始化日志存储，首次启动时自动迁移已有的日志文件
+if LOG_FORMAT == 'sqlite':
+    store = SqliteLogStore(LOG_DB_FILE)
+    migrate_source = JSONL_LOG_FILE if os.path.exists(JSONL_LOG_FILE) else LOG_FILE
+elif LOG_FORMAT == 'segments':
+    store = SegmentedLogStore(LOG_SEGMENT_DIR, partition=LOG_SEGMENT_PARTITION)
+    migrate_source = JSONL_LOG_FILE if os.path.exists(JSONL_LOG_FILE) else LOG_FILE
+elif LOG_FORMAT == 'jsonl':
+    store = JsonlLogStore(JSONL_LOG_FILE)
+    migrate_source = LOG_FILE
+else:
+    store = JsonArrayLogStore(LOG_FILE)
+    migrate_source = None
+
+if migrate_source:
+    try:
+        migrated = migrate_logs(migrate_source, store)
+        if migrated:
+            logger.info(f"已将 {migrated} 条日志从 {migrate_source} 迁移到 {store.path}")
+    except Exception as e:
+        logger.error(f"迁移日志文件失败: {e}")
+
+# 后台批量写入线程，首次提交日志时在当前进程中启动（gunicorn --preload时各工作进程分别启动），进程退出时写完队列中剩余的日志
+log_writer = None
+if LOG_WRITE_MODE == 'async':
+    log_writer = BatchLogWriter(
+        store,
+        max_queue=LOG_QUEUE_SIZE,
+        batch_size=LOG_BATCH_SIZE,
+        flush_interval=LOG_FLUSH_INTERVAL,
+        durability=LOG_FSYNC_POLICY,
+        fsync_interval=LOG_FSYNC_INTERVAL
+    )
+    atexit.register(log_writer.close)
+
+    # atexit在收到SIGTERM时不会执行，这里先写完队列再交给原来的处理函数（或直接退出）
+    def _close_on_sigterm(signum, frame):
+        log_writer.close()
+        if callable(_previous_sigterm):
+            _previous_sigterm(signum, frame)
+        elif _previous_sigterm != signal.SIG_IGN:
+            sys.exit(0)
+
+    if threading.current_thread() is threading.main_thread():
+        _previous_sigterm = signal.signal(signal.SIGTERM, _close_on_sigterm)
 
 # 辅助函数：保存日志到JSON文件
 def save_log_to_json(log_data):
-    """将日志数据保存到JSON文件"""
-    logs = []
-    
-    # 读取现有日志
-    if os.path.exists(LOG_FILE):
-        try:
-            with open(LOG_FILE, 'r', encoding='utf-8') as f:
-                logs = json.load(f)
-        except:
-            logs = []
-    
-    # 添加新日志
-    logs.append(log_data)
-    
-    # 保存更新后的日志
+    """将日志数据保存到日志文件（async模式下只入队，由后台线程批量写入）"""
     try:
-        with open(LOG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(logs, f, ensure_ascii=False, indent=2)
+        if log_writer is not None:
+            return log_writer.submit(log_data)
+        store.append(log_data)
+        if log_broadcaster is not None:
+            log_broadcaster.notify()
         return True
     except Exception as e:
         logger.error(f"保存日志到JSON文件失败: {e}")
         return False
 
 # 辅助函数：读取JSON日志
-def read_logs_from_json():
-    """从JSON文件读取日志"""
-    logs = []
-    
-    if os.path.exists(LOG_FILE):
-        try:
-            with open(LOG_FILE, 'r', encoding='utf-8') as f:
-                logs = json.load(f)
-        except Exception as e:
-            logger.error(f"读取JSON日志文件失败: {e}")
-            logs = []
-    
-    # 按时间倒序排列
-    logs.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-    
-    return logs
+def read_logs_from_json(date=None):
+    """从日志文件读取日志，按时间倒序排列；指定日期（YYYY-MM-DD）时只读取当天的日志"""
+    try:
+        return store.read_logs(date)
+    except Exception as e:
+        logger.error(f"读取JSON日志文件失败: {e}")
+        return []
 
 @app.route('/api/save-log', methods=['POST'])
 def save_log():
@@ -328,30 +200,6 @@ def save_log():
         lng = data.get('longitude', 'N/A')
         public_ip = data.get('public_ip', 'N/A')
         
-        # 生成高德地图链接（经纬度有效时）
-        amap_url = "#"
-        if lat != 'N/A' and lng != 'N/A':
-            try:
-                # 将WGS-84坐标转换为GCJ-02坐标（高德地图使用的坐标系）
-                wgs_lng = float(lng)
-                wgs_lat = float(lat)
-                gcj_lng, gcj_lat = wgs84_to_gcj02(wgs_lng, wgs_lat)
-                amap_url = f"https://uri.amap.com/marker?position={gcj_lng:.6f},{gcj_lat:.6f}&name=当前位置&coordinate=gaode"
-            except:
-                # 转换失败时使用原始坐标
-                amap_url = f"https://uri.amap.com/marker?position={lng},{lat}&name=当前位置&coordinate=gaode"
-        
-        # 简化输出，只包含时间、IP、经纬度和高德地图链接
-        print("\n" + "="*50)
-        print(f"[+] 获取时间  : {timestamp}")
-        print(f"[+] 公网IP    : {public_ip}")
-        print(f"[+] 经纬度    : {lat}, {lng}")
-        print(f"[+] 高德地图  : {amap_url}")
-        print(f"[+] 设备类型  : {data.get('deviceType', 'N/A')}")
-        print(f"[+] 浏览器    : {data.get('browser', 'N/A')[:50]}...")
-        print(f"[+] 操作系统  : {data.get('os', 'N/A')}")
-        print("="*50 + "\n")
-        
         # 构建日志条目
         log_entry = {
             'timestamp': timestamp,
@@ -388,8 +236,24 @@ def save_log():
             'sessionStorage': data.get('sessionStorage', 'N/A')
         }
         
-        # 保存到JSON文件
-        save_log_to_json(log_entry)
+        # 写入时计算派生字段（GCJ-02坐标、高德地图链接、平台、时间戳），读取时不再重复计算
+        add_derived_fields(log_entry)
+        amap_url = log_entry['map_url']
+        
+        # 简化输出，只包含时间、IP、经纬度和高德地图链接
+        print("\n" + "="*50)
+        print(f"[+] 获取时间  : {timestamp}")
+        print(f"[+] 公网IP    : {public_ip}")
+        print(f"[+] 经纬度    : {lat}, {lng}")
+        print(f"[+] 高德地图  : {amap_url}")
+        print(f"[+] 设备类型  : {data.get('deviceType', 'N/A')}")
+        print(f"[+] 浏览器    : {data.get('browser', 'N/A')[:50]}...")
+        print(f"[+] 操作系统  : {data.get('os', 'N/A')}")
+        print("="*50 + "\n")
+        
+        # 保存到JSON文件；写入队列已满或写入失败时返回503，客户端可稍后重试
+        if not save_log_to_json(log_entry):
+            return jsonify({'status': 'error', 'message': '日志写入繁忙，请稍后重试'}), 503
         
         # 同时记录到文本日志文件
         device_identifier = f"{log_entry['os']} - {log_entry['browser']} - {log_entry['public_ip']}"
@@ -407,51 +271,168 @@ def save_log():
         return jsonify({'status': 'error'})
 
 # 解析日志文件的函数
-def parse_logs():
-    """解析日志文件，返回处理后的日志条目列表"""
-    logs = read_logs_from_json()
-    processed_logs = []
+def process_log(log):
+    """将一条日志投影为页面展示用的条目（派生字段已在写入时计算）"""
+    if 'map_url' not in log:
+        # 尚未补充派生字段的历史日志（可运行 python log_store.py backfill 一次性补充）
+        log = dict(log)
+        add_derived_fields(log)
     
-    for log in logs:
-        # 生成高德地图链接
-        map_url = "#"
-        lat = log.get('latitude', 'N/A')
-        lng = log.get('longitude', 'N/A')
-        
-        if lat != 'N/A' and lng != 'N/A':
-            try:
-                wgs_lng = float(lng)
-                wgs_lat = float(lat)
-                gcj_lng, gcj_lat = wgs84_to_gcj02(wgs_lng, wgs_lat)
-                map_url = f"https://uri.amap.com/marker?position={gcj_lng:.6f},{gcj_lat:.6f}&name=当前位置&coordinate=gaode"
-            except:
-                map_url = f"https://uri.amap.com/marker?position={lng},{lat}&name=当前位置&coordinate=gaode"
-        
-        # 构建处理后的日志条目
-        processed_log = {
-            'time': log.get('timestamp', 'N/A'),
-            'ip': log.get('public_ip', 'N/A'),
-            'lat': lat,
-            'lng': lng,
-            'map_url': map_url,
-            'device_type': log.get('deviceType', 'N/A'),
-            'browser': log.get('browser', 'N/A'),
-            'os': log.get('os', 'N/A'),
-            'platform': log.get('platform', 'N/A'),
-            'cpu_cores': log.get('cpuCores', 'N/A'),
-            'device_memory': log.get('deviceMemory', 'N/A'),
-            'resolution': log.get('resolution', 'N/A'),
-            'gpu': f"{log.get('gpuVendor', 'N/A')} {log.get('gpu', 'N/A')}",
-            'country': log.get('country', 'N/A'),
-            'region': log.get('region', 'N/A'),
-            'city': log.get('city', 'N/A'),
-            'isp': log.get('isp', 'N/A'),
-            'timezone': log.get('timezone', 'N/A')
-        }
-        
-        processed_logs.append(processed_log)
-    
-    return processed_logs
+    return {
+        'time': log.get('timestamp', 'N/A'),
+        'epoch': log.get('epoch'),
+        'ip': log.get('public_ip', 'N/A'),
+        'lat': log.get('latitude', 'N/A'),
+        'lng': log.get('longitude', 'N/A'),
+        'map_url': log['map_url'],
+        'device_type': log.get('deviceType', 'N/A'),
+        'browser': log.get('browser', 'N/A'),
+        'os': log.get('os', 'N/A'),
+        'platform': log.get('platform', 'N/A'),
+        'cpu_cores': log.get('cpuCores', 'N/A'),
+        'device_memory': log.get('deviceMemory', 'N/A'),
+        'resolution': log.get('resolution', 'N/A'),
+        'gpu': f"{log.get('gpuVendor', 'N/A')} {log.get('gpu', 'N/A')}",
+        'country': log.get('country', 'N/A'),
+        'region': log.get('region', 'N/A'),
+        'city': log.get('city', 'N/A'),
+        'isp': log.get('isp', 'N/A'),
+        'timezone': log.get('timezone', 'N/A')
+    }
+
+# 内存日志索引：首次读取时加载全部日志，之后每次请求只增量读取新写入的日志
+# 尚未补充派生字段的历史日志在读入时批量计算坐标，不再逐条转换
+log_index = LogIndex(store, process_log, unique_ips=LOG_STATS_UNIQUE_IPS, prepare=add_derived_fields_many,
+                     geo_precision=GEO_GRID_MAX_PRECISION) if LOG_INDEX == 'on' else None
+
+# 新日志推送：写入线程每写入一个批次就唤醒所有推送连接
+log_broadcaster = LogBroadcaster(log_index, poll_interval=LOG_STREAM_POLL_INTERVAL) if log_index is not None else None
+if log_writer is not None and log_broadcaster is not None:
+    log_writer.on_flush = log_broadcaster.notify
+
+# IP详情查询，结果缓存在进程内和工作进程共享的SQLite数据库中，启动时从数据库预热
+shared_ip_cache = None
+if IP_CACHE_DB:
+    try:
+        shared_ip_cache = SqliteIPCache(IP_CACHE_DB, max_entries=IP_CACHE_DB_SIZE, ttl=IP_CACHE_DB_TTL, negative_ttl=IP_CACHE_NEGATIVE_TTL)
+    except Exception as e:
+        logger.error(f"打开IP缓存数据库失败: {e}")
+configure_http(pool_size=IP_LOOKUP_POOL_SIZE, retries=IP_LOOKUP_RETRIES, connect_timeout=IP_LOOKUP_CONNECT_TIMEOUT)
+atexit.register(close_sessions)
+configure_health(failure_threshold=IP_PROVIDER_FAILURE_THRESHOLD, cooldown=IP_PROVIDER_COOLDOWN)
+if IP_LOOKUP_MODE == 'hedged':
+    ip_fetch = HedgedFetcher(max_parallel=IP_LOOKUP_PARALLEL, hedge_delay=IP_LOOKUP_HEDGE_DELAY, timeout=IP_LOOKUP_TIMEOUT)
+else:
+    ip_fetch = get_ip_details
+offline_ip_db = None
+if IP_OFFLINE_DB and os.path.exists(IP_OFFLINE_DB):
+    try:
+        offline_ip_db = IPRangeDatabase(IP_OFFLINE_DB)
+        logger.info(f"已加载离线IP数据库 {IP_OFFLINE_DB}，共 {offline_ip_db.size} 个地址段")
+    except Exception as e:
+        logger.error(f"加载离线IP数据库失败: {e}")
+ip_lookup = IPLookup(IPCache(maxsize=IP_CACHE_SIZE, ttl=IP_CACHE_TTL, negative_ttl=IP_CACHE_NEGATIVE_TTL), shared_ip_cache, ip_fetch, offline_ip_db,
+                     budget=IP_LOOKUP_BUDGET or None, max_background=IP_LOOKUP_MAX_PENDING)
+warmed = ip_lookup.warm_up()
+if warmed:
+    logger.info(f"已从 {IP_CACHE_DB} 预热 {warmed} 条IP查询结果")
+
+def parse_logs(date=None):
+    """解析日志文件，返回处理后的日志条目列表"""
+    if log_index is not None:
+        return log_index.get_logs(date)
+    return [process_log(log) for log in read_logs_from_json(date)]
+
+def query_logs(date=None, since=None):
+    """返回 (日志, 游标, 是否为全量)；指定since游标时只返回该游标之后新增的日志，未启用内存索引时总是返回全量且游标为None"""
+    if log_index is None:
+        return parse_logs(date), None, True
+    logs, cursor, full = log_index.get_since(since)
+    if date:
+        logs = [log for log in logs if log['time'].startswith(date)]
+    return logs, cursor, full
+
+def get_log_stats(logs=None, date=None):
+    """统计总数、独立IP数和今日日志数；未按日期筛选时直接使用内存索引中增量维护的统计，logs为None时按需读取日志"""
+    if log_index is not None and not date:
+        return log_index.get_stats()
+    if logs is None:
+        logs = parse_logs(date)
+    today = datetime.now().strftime('%Y-%m-%d')
+    return {
+        'total_logs': len(logs),
+        'unique_ips': len(set(log['ip'] for log in logs if log['ip'] != 'N/A')),
+        'today_logs': len([log for log in logs if log['time'].startswith(today)])
+    }
+
+def get_date_filter():
+    """读取请求中的日期筛选参数（today或YYYY-MM-DD），未指定或格式错误时返回None"""
+    date = request.args.get('date', '').strip()
+    if date == 'today':
+        return datetime.now().strftime('%Y-%m-%d')
+    try:
+        datetime.strptime(date, '%Y-%m-%d')
+        return date
+    except ValueError:
+        return None
+
+def get_page_params():
+    """读取请求中的分页和排序参数：page（从1开始）、per_page、sort（SORT_FIELDS之一）和order（asc或desc）"""
+    per_page = request.args.get('per_page', LOG_PAGE_SIZE, type=int)
+    sort = request.args.get('sort', 'time')
+    return {
+        'page': max(request.args.get('page', 1, type=int), 1),
+        'per_page': min(max(per_page, 1), LOG_MAX_PAGE_SIZE),
+        'sort': sort if sort in SORT_FIELDS else 'time',
+        'order': 'asc' if request.args.get('order') == 'asc' else 'desc'
+    }
+
+def get_log_page(date=None, page=1, per_page=LOG_PAGE_SIZE, sort='time', order='desc'):
+    """返回后台页面需要的当前页日志（logs）、分页信息（pagination）、增量游标（cursor）和统计信息
+
+    启用内存索引时只取出当前页，不复制也不排序全部日志；页码超出范围时返回最后一页。
+    """
+    descending = order == 'desc'
+    cursor = None
+    if log_index is not None:
+        logs, total, cursor = log_index.get_page((page - 1) * per_page, per_page, date, sort, descending)
+        pages = max(1, -(-total // per_page))
+        if page > pages:
+            page = pages
+            logs, total, cursor = log_index.get_page((page - 1) * per_page, per_page, date, sort, descending)
+        stats = get_log_stats(None, date)
+    else:
+        all_logs = parse_logs(date)
+        total = len(all_logs)
+        pages = max(1, -(-total // per_page))
+        page = min(page, pages)
+        logs = select_page(all_logs, (page - 1) * per_page, per_page, sort, descending)
+        stats = get_log_stats(all_logs, date)
+    pagination = {'page': page, 'per_page': per_page, 'pages': pages, 'total': total, 'sort': sort, 'order': order}
+    return {'logs': logs, 'pagination': pagination, 'cursor': cursor, **stats}
+
+def compress_response(response):
+    """按请求的Accept-Encoding用brotli或gzip压缩响应，较小的响应不压缩；压缩后ETag改为弱ETag"""
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if not encoding or response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+@app.template_global()
+def page_url(**params):
+    """当前页面的链接：保留日期筛选、排序等查询参数，并用params覆盖"""
+    args = request.args.to_dict()
+    args.update(params)
+    return url_for(request.endpoint, **args)
 
 # 后台管理路由
 @app.route('/admin', methods=['GET', 'POST'])
@@ -478,16 +459,11 @@ def admin_home():
     if 'admin_logged_in' not in session or not session['admin_logged_in']:
         return redirect(url_for('admin'))
     
-    # 解析日志
-    logs = parse_logs()
-    
-    # 统计信息
-    total_logs = len(logs)
-    unique_ips = len(set(log['ip'] for log in logs if log['ip'] != 'N/A'))
-    today = datetime.now().strftime('%Y-%m-%d')
-    today_logs = len([log for log in logs if log['time'].startswith(today)])
+    # 只解析当前页的日志
+    date_filter = get_date_filter()
+    page = get_log_page(date_filter, **get_page_params())
     
-    return render_template('admin.html', logs=logs, total_logs=total_logs, unique_ips=unique_ips, today_logs=today_logs)
+    return render_template('admin.html', date_filter=date_filter, **page)
 
 @app.route('/admin/logout')
 def admin_logout():
@@ -503,16 +479,11 @@ def index():
         # 科技感后台：处理登录和显示后台
         # 如果已登录，直接显示科技感后台首页内容
         if 'tech_admin_logged_in' in session and session['tech_admin_logged_in']:
-            # 解析日志
-            logs = parse_logs()
+            # 只解析当前页的日志
+            date_filter = get_date_filter()
+            page = get_log_page(date_filter, **get_page_params())
             
-            # 统计信息
-            total_logs = len(logs)
-            unique_ips = len(set(log['ip'] for log in logs if log['ip'] != 'N/A'))
-            today = datetime.now().strftime('%Y-%m-%d')
-            today_logs = len([log for log in logs if log['time'].startswith(today)])
-            
-            return render_template('tech_admin.html', logs=logs, total_logs=total_logs, unique_ips=unique_ips, today_logs=today_logs)
+            return render_template('tech_admin.html', **page)
         
         # 处理登录请求
         if request.method == 'POST':
@@ -520,15 +491,10 @@ def index():
             if password == TECH_ADMIN_PASSWORD:
                 session['tech_admin_logged_in'] = True
                 # 登录成功后直接显示后台首页内容
-                logs = parse_logs()
-                
-                # 统计信息
-                total_logs = len(logs)
-                unique_ips = len(set(log['ip'] for log in logs if log['ip'] != 'N/A'))
-                today = datetime.now().strftime('%Y-%m-%d')
-                today_logs = len([log for log in logs if log['time'].startswith(today)])
+                date_filter = get_date_filter()
+                page = get_log_page(date_filter, **get_page_params())
                 
-                return render_template('tech_admin.html', logs=logs, total_logs=total_logs, unique_ips=unique_ips, today_logs=today_logs)
+                return render_template('tech_admin.html', **page)
             else:
                 return render_template('tech_admin_login.html', error='密码错误')
         
@@ -551,21 +517,95 @@ def tech_admin_api_logs():
     if 'tech_admin_logged_in' not in session or not session['tech_admin_logged_in']:
         return jsonify({'error': '未登录'}), 401
     
-    # 解析日志
-    logs = parse_logs()
+    # 解析日志：带since游标时只返回该游标之后新增的日志
+    date_filter = get_date_filter()
+    logs, cursor, full = query_logs(date_filter, request.args.get('since'))
+    # 带page或per_page参数时，需要返回全量日志的情况下只返回当前页
+    paged = 'page' in request.args or 'per_page' in request.args
+    page_params = get_page_params() if paged else None
+    # format=columnar时日志使用列式格式（字段名只出现一次，重复的值使用字典编码）
+    columnar = request.args.get('format') == 'columnar'
     
-    # 统计信息
-    total_logs = len(logs)
-    unique_ips = len(set(log['ip'] for log in logs if log['ip'] != 'N/A'))
-    today = datetime.now().strftime('%Y-%m-%d')
-    today_logs = len([log for log in logs if log['time'].startswith(today)])
+    # 日志没有变化时返回304，不再序列化日志（压缩后的响应使用弱ETag，因此按弱比较）
+    etag = f"{cursor}-{date_filter or ''}-{datetime.now().strftime('%Y%m%d')}" if cursor else None
+    if etag and paged:
+        etag += '-{page}-{per_page}-{sort}-{order}'.format(**page_params)
+    if etag and columnar:
+        etag += '-columnar'
+    if etag and request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    
+    if full and paged:
+        payload = {'reset': True, **get_log_page(date_filter, **page_params)}
+    else:
+        # 统计信息
+        stats = get_log_stats(logs if full else None, date_filter)
+        
+        payload = {
+            'logs': logs,
+            'cursor': cursor,
+            'reset': full,
+            **stats
+        }
+    if columnar:
+        payload['logs'] = encode_columnar(payload['logs'])
+        response = app.response_class(json.dumps(payload, ensure_ascii=False, separators=(',', ':')), mimetype='application/json')
+    else:
+        response = jsonify(payload)
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+    return compress_response(response)
+
+@app.route('/tech-admin/api/stream')
+def tech_admin_api_stream():
+    """科技感后台推送接口（Server-Sent Events），有新日志时推送新日志和最新统计"""
+    # 检查是否登录
+    if 'tech_admin_logged_in' not in session or not session['tech_admin_logged_in']:
+        return jsonify({'error': '未登录'}), 401
+    if log_broadcaster is None:
+        return jsonify({'error': '未启用内存日志索引'}), 404
     
-    return jsonify({
-        'logs': logs,
-        'total_logs': total_logs,
-        'unique_ips': unique_ips,
-        'today_logs': today_logs
-    })
+    # 断线重连时浏览器会通过Last-Event-ID带回最后收到的游标
+    date_filter = get_date_filter()
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('since')
+    stats = lambda: get_log_stats(None, date_filter)
+    # 带分页参数时，需要推送全量日志的情况下（日志被重写）只推送当前页
+    page = None
+    if 'page' in request.args or 'per_page' in request.args:
+        page_params = get_page_params()
+        page = lambda: get_log_page(date_filter, **page_params)
+    encode = encode_columnar if request.args.get('format') == 'columnar' else None
+    response = Response(log_broadcaster.stream(cursor, date_filter, stats, page, encode), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 禁止nginx缓冲推送内容
+    return response
+
+@app.route('/tech-admin/api/ip-stats')
+def tech_admin_api_ip_stats():
+    """IP查询统计：缓存命中率、各查询服务的成功率、平均耗时和熔断状态"""
+    # 检查是否登录
+    if 'tech_admin_logged_in' not in session or not session['tech_admin_logged_in']:
+        return jsonify({'error': '未登录'}), 401
+    return jsonify(ip_lookup.stats())
+
+@app.route('/tech-admin/api/geo-grid')
+def tech_admin_api_geo_grid():
+    """访客分布网格：按geohash汇总的访问次数，precision不超过GEO_GRID_MAX_PRECISION"""
+    # 普通后台和科技感后台登录后都可以使用
+    if not session.get('tech_admin_logged_in') and not session.get('admin_logged_in'):
+        return jsonify({'error': '未登录'}), 401
+    precision = request.args.get('precision', type=int)
+    if log_index is not None:
+        return jsonify(log_index.get_geo_grid(precision))
+    # 未启用内存日志索引时读取全部日志统计
+    grid = GeoGrid(GEO_GRID_MAX_PRECISION)
+    for log in store.iter_logs():
+        add_derived_fields(log)
+        grid.add(log)
+    return jsonify(grid.snapshot(precision))
 
 @app.route('/tech-admin/logout')
 def tech_admin_logout():
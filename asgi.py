@@ -0,0 +1,78 @@
+"""ASGI入口：/api/ip-info 在事件循环中异步查询，一个进程可以同时处理大量IP查询；其余路由仍由Flask应用处理
+
+需要额外安装：pip install httpx a2wsgi uvicorn
+启动：uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import logging
+import os
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import Headers
+
+from app import (IP_LOOKUP_HEDGE_DELAY, IP_LOOKUP_MODE, IP_LOOKUP_PARALLEL, IP_LOOKUP_TIMEOUT, app as flask_app,
+                 build_ip_info, get_real_ip, ip_lookup)
+from ip_lookup_async import AsyncHedgedFetcher, AsyncIPLookup
+
+logger = logging.getLogger(__name__)
+
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))  # 运行Flask路由的线程数，每个请求（包括SSE推送连接）占用一个线程
+
+# sequential模式即同时只进行一个请求
+async_fetch = AsyncHedgedFetcher(
+    max_parallel=IP_LOOKUP_PARALLEL if IP_LOOKUP_MODE == 'hedged' else 1,
+    hedge_delay=IP_LOOKUP_HEDGE_DELAY,
+    timeout=IP_LOOKUP_TIMEOUT
+)
+async_ip_lookup = AsyncIPLookup(ip_lookup, async_fetch)
+# 不使用asgiref的WsgiToAsgi：它默认把所有请求放在同一个线程中依次运行，一个SSE连接就会阻塞其余全部路由
+wsgi_app = WSGIMiddleware(flask_app, workers=ASGI_THREADS)
+
+
+def _headers(scope):
+    """把ASGI请求头转换为不区分大小写的Headers"""
+    return Headers([(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope.get('headers', [])])
+
+
+async def _send_json(send, data, status=200, extra_headers=()):
+    """发送JSON响应，序列化方式与Flask的jsonify相同"""
+    body = flask_app.json.dumps(data).encode('utf-8')
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    headers.extend(extra_headers)
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def get_ip_info(scope, receive, send):
+    """异步版本的/api/ip-info，返回结果与Flask路由相同"""
+    client = scope.get('client')
+    remote_addr = client[0] if client else 'N/A'
+    try:
+        real_ip = get_real_ip(_headers(scope), remote_addr)
+        ip_data, degraded = await async_ip_lookup.resolve(real_ip)
+        extra_headers = [(b'x-ip-lookup-degraded', b'1')] if degraded else []
+        await _send_json(send, build_ip_info(real_ip, ip_data, degraded), extra_headers=extra_headers)
+    except Exception as e:
+        logger.error(f"Error getting IP info: {e}")
+        await _send_json(send, build_ip_info(remote_addr, {}, degraded=True))
+
+
+async def lifespan(scope, receive, send):
+    """处理服务器的启动和关闭事件，关闭时释放异步HTTP客户端"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_fetch.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/api/ip-info' and scope['method'] == 'GET':
+        await get_ip_info(scope, receive, send)
+    else:
+        # 其他路由（页面、保存日志、后台、SSE推送）由Flask应用处理，每个请求在ASGI_THREADS个线程的线程池中运行
+        await wsgi_app(scope, receive, send)
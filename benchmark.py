@@ -0,0 +1,260 @@
+"""性能基准：坐标转换、日志写入、日志读取、parse_logs和统计，在合成日志上计时，不需要网络
+
+每种存储格式、每个日志规模分别生成合成日志，结果以JSON输出，便于比较各项存储和缓存改动的效果。
+
+用法：
+    python benchmark.py                                   # 默认1万/10万/100万条
+    python benchmark.py --sizes 10000 100000 --formats jsonl sqlite --output bench.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+FORMATS = ('json', 'jsonl', 'sqlite', 'segments')
+STORE_PATHS = {'json': 'bench.json', 'jsonl': 'bench.jsonl', 'sqlite': 'bench.db', 'segments': 'bench_segments'}
+
+_OS = ('Windows 10', 'Android 13', 'iOS 17.2', 'macOS 14.1', 'Linux x86_64')
+_BROWSERS = ('Chrome/120.0.0.0', 'Safari/605.1.15', 'Firefox/121.0', 'Edg/120.0.0.0')
+_DEVICE_TYPES = ('Desktop', 'Mobile', 'Tablet')
+_PLACES = (
+    ('中国', '北京市', '北京', '中国联通'), ('中国', '上海市', '上海', '中国电信'),
+    ('中国', '广东省', '广州', '中国移动'), ('中国', '四川省', '成都', '中国电信'), ('N/A', 'N/A', 'N/A', 'N/A'),
+)
+
+
+def generate_logs(count, seed=0, days=30):
+    """生成count条合成日志（按时间正序），约1/20的日志有不同的IP，约1/10没有坐标"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    step = days * 86400 / max(count, 1)
+    ip_count = max(count // 20, 1)
+    for i in range(count):
+        country, region, city, isp = rng.choice(_PLACES)
+        ip = rng.randrange(ip_count)
+        has_coordinates = rng.random() >= 0.1
+        yield {
+            'timestamp': (start + timedelta(seconds=int(i * step))).strftime('%Y-%m-%d %H:%M:%S'),
+            'os': rng.choice(_OS),
+            'platform': 'Win32',
+            'cpuCores': rng.choice((4, 8, 12)),
+            'deviceMemory': rng.choice((4, 8)),
+            'gpuVendor': 'Google Inc.',
+            'gpu': 'ANGLE (Intel, Intel(R) UHD Graphics 630)',
+            'resolution': '1920x1080',
+            'viewport': '1920x911',
+            'browser': rng.choice(_BROWSERS),
+            'public_ip': f"10.{ip >> 16 & 255}.{ip >> 8 & 255}.{ip & 255}",
+            'city': city,
+            'region': region,
+            'country': country,
+            'latitude': f"{rng.uniform(22.0, 42.0):.6f}" if has_coordinates else 'N/A',
+            'longitude': f"{rng.uniform(100.0, 122.0):.6f}" if has_coordinates else 'N/A',
+            'geolocationAccuracy': 20,
+            'isp': isp,
+            'timezone': 'Asia/Shanghai',
+            'language': 'zh-CN',
+            'deviceType': rng.choice(_DEVICE_TYPES),
+        }
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _timed(func, repeat=1):
+    """返回 (最短耗时秒数, 最后一次的返回值)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+class Benchmark:
+    """收集计时结果"""
+
+    def __init__(self, repeat=3):
+        self.repeat = repeat
+        self.results = []
+
+    def record(self, name, records, seconds, fmt=None, ops=1, **extra):
+        result = {
+            'benchmark': name,
+            'format': fmt,
+            'records': records,
+            'ops': ops,
+            'seconds': round(seconds, 6),
+            'per_op_us': round(seconds / ops * 1e6, 3) if ops else None,
+        }
+        result.update(extra)
+        self.results.append(result)
+        label = f"{name} [{fmt}]" if fmt else name
+        print(f"{label:<40} n={records:<8} {seconds * 1000:10.1f} ms  ({result['per_op_us']} us/op)", file=sys.stderr)
+        return result
+
+    def run(self, name, records, func, fmt=None, ops=1, repeat=None, **extra):
+        seconds, result = _timed(func, repeat or self.repeat)
+        self.record(name, records, seconds, fmt, ops, **extra)
+        return result
+
+
+def bench_coordinates(bench, count):
+    """逐点转换与批量转换"""
+    from coord_transform import np, wgs84_to_gcj02, wgs84_to_gcj02_batch
+
+    rng = random.Random(count)
+    lngs = [rng.uniform(73.0, 135.0) for _ in range(count)]
+    lats = [rng.uniform(4.0, 53.0) for _ in range(count)]
+    bench.run('wgs84_to_gcj02 (scalar)', count, lambda: [wgs84_to_gcj02(lng, lat) for lng, lat in zip(lngs, lats)],
+              ops=count, repeat=1)
+    bench.run('wgs84_to_gcj02_batch', count, lambda: wgs84_to_gcj02_batch(lngs, lats),
+              ops=count, numpy=np is not None)
+
+
+def bench_store(bench, app, fmt, count, workdir, append_ops):
+    """在一种存储格式上依次测试：写入、读取、parse_logs和统计"""
+    from log_index import LogIndex
+    from log_store import add_derived_fields_many, open_log_store
+    from log_writer import BatchLogWriter
+
+    path = os.path.join(workdir, STORE_PATHS[fmt])
+    if fmt == 'segments':
+        os.makedirs(path, exist_ok=True)
+    store = open_log_store(path)
+
+    # 生成合成日志（写入时已计算派生字段，与app.py的写入路径一致）
+    def populate():
+        if fmt == 'json':
+            logs = list(generate_logs(count))
+            add_derived_fields_many(logs)
+            store.replace_all(logs)
+            return
+        for chunk in _chunks(generate_logs(count), 10000):
+            add_derived_fields_many(chunk)
+            store.append_many(chunk)
+    bench.run('populate', count, populate, fmt=fmt, ops=count, repeat=1)
+
+    extra = list(generate_logs(append_ops, seed=1))
+    add_derived_fields_many(extra)
+    for log in extra:
+        log['timestamp'] = '2024-02-01 00:00:00'
+
+    # save_log_to_json的同步写入（旧版JSON数组每次都要重写整个文件）
+    ops = append_ops if fmt != 'json' else min(append_ops, 5 if count <= 100000 else 1)
+    bench.run('store.append (sync save_log_to_json)', count,
+              lambda: [store.append(log) for log in extra[:ops]], fmt=fmt, ops=ops, repeat=1)
+
+    # 异步写入：请求线程只入队，后台线程批量写入
+    if fmt != 'json':
+        writer = BatchLogWriter(store, durability='none').start()
+        gc.collect()
+        start = time.perf_counter()
+        for log in extra:
+            writer.submit(log)
+        submitted = time.perf_counter()
+        writer.close()
+        finished = time.perf_counter()
+        bench.record('BatchLogWriter.submit (async save_log_to_json)', count, submitted - start, fmt=fmt, ops=len(extra))
+        bench.record('BatchLogWriter submit + drain', count, finished - start, fmt=fmt, ops=len(extra))
+
+    total = count + ops + (len(extra) if fmt != 'json' else 0)
+    bench.run('read_logs_from_json (all)', total, store.read_logs, fmt=fmt, repeat=1)
+    bench.run('read_logs_from_json (one day)', total, lambda: store.read_logs('2024-01-15'), fmt=fmt, repeat=1)
+
+    # parse_logs：未启用内存索引时每次读取并处理全部日志
+    logs = bench.run('parse_logs (LOG_INDEX=off)', total,
+                     lambda: [app.process_log(log) for log in store.read_logs()], fmt=fmt, repeat=1)
+    bench.run('admin_home stats (full scan)', total, lambda logs=logs: app.get_log_stats(logs), fmt=fmt)
+    del logs  # 释放内存，以下各项只使用索引
+
+    # parse_logs：内存索引首次加载，之后只增量读取
+    index = LogIndex(store, app.process_log, prepare=add_derived_fields_many)
+    bench.run('parse_logs (index, cold load)', total, index.get_logs, fmt=fmt, repeat=1)
+    bench.run('parse_logs (index, no new logs)', total, index.get_logs, fmt=fmt)
+    new_log = dict(extra[0], timestamp='2024-02-02 00:00:00')
+    bench.run('parse_logs (index, 1 new log)', total,
+              lambda index=index: (store.append(new_log), index.get_logs()), fmt=fmt, repeat=1)
+    bench.run('admin_home stats (index)', total, index.get_stats, fmt=fmt)
+    bench.run('admin_home page (index, by time)', total, lambda index=index: index.get_page(0, 50), fmt=fmt)
+    bench.run('admin_home page (index, by city)', total, lambda index=index: index.get_page(0, 50, sort='city'), fmt=fmt)
+    del index
+    gc.collect()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='日志处理热点路径的性能基准（不需要网络）')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='合成日志的条数')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS), help='测试的存储格式')
+    parser.add_argument('--json-max', type=int, default=100000, help='旧版JSON数组格式只测试不超过该条数的规模')
+    parser.add_argument('--append-ops', type=int, default=1000, help='写入测试的日志条数')
+    parser.add_argument('--repeat', type=int, default=3, help='较快的测试重复次数，取最短耗时')
+    parser.add_argument('--workdir', help='合成日志的存放目录，默认使用临时目录并在结束后删除')
+    parser.add_argument('--output', help='结果JSON文件，默认输出到标准输出')
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='tracker-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    # app.py在导入时按当前目录创建日志存储并启动写入线程，这里使用同步写入、关闭索引和IP缓存，不访问网络
+    os.environ.update({'LOG_WRITE_MODE': 'sync', 'LOG_INDEX': 'off', 'IP_CACHE_DB': '', 'IP_OFFLINE_DB': ''})
+    cwd = os.getcwd()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    try:
+        import app
+        from coord_transform import np
+
+        bench = Benchmark(repeat=args.repeat)
+        for count in args.sizes:
+            bench_coordinates(bench, count)
+            for fmt in args.formats:
+                if fmt == 'json' and count > args.json_max:
+                    print(f"跳过 json 格式的 {count} 条日志（超过 --json-max）", file=sys.stderr)
+                    continue
+                run_dir = os.path.join(workdir, f"{fmt}-{count}")
+                os.makedirs(run_dir, exist_ok=True)
+                try:
+                    bench_store(bench, app, fmt, count, run_dir, args.append_ops)
+                finally:
+                    shutil.rmtree(run_dir, ignore_errors=True)
+    finally:
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__ if np is not None else None,
+        'results': bench.results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""坐标转换：WGS-84（GPS原始坐标）转GCJ-02（高德地图使用的坐标系）
+
+批量转换在安装了NumPy时向量化计算，未安装时逐点计算。
+"""
+import math
+
+try:
+    import numpy as np
+except ImportError:  # NumPy为可选依赖
+    np = None
+
+AMAP_MARKER_URL = "https://uri.amap.com/marker?position={lng},{lat}&name=当前位置&coordinate=gaode"
+
+
+# WGS-84转GCJ-02坐标转换函数
+def wgs84_to_gcj02(lng, lat):
+    """将WGS-84坐标转换为GCJ-02坐标"""
+    PI = math.pi
+    a = 6378137.0
+    ee = 0.00669342162296594323
+
+    if out_of_china(lng, lat):
+        return lng, lat
+
+    d_lat = transform_lat(lng - 105.0, lat - 35.0)
+    d_lng = transform_lng(lng - 105.0, lat - 35.0)
+    rad_lat = lat / 180.0 * PI
+    magic = math.sin(rad_lat)
+    magic = 1 - ee * magic * magic
+    sqrt_magic = math.sqrt(magic)
+    d_lat = (d_lat * 180.0) / ((a * (1 - ee)) / (magic * sqrt_magic) * PI)
+    d_lng = (d_lng * 180.0) / (a / sqrt_magic * math.cos(rad_lat) * PI)
+
+    gcj_lat = lat + d_lat
+    gcj_lng = lng + d_lng
+
+    return gcj_lng, gcj_lat
+
+def transform_lat(x, y):
+    """计算纬度偏移量"""
+    PI = math.pi
+    ret = -100.0 + 2.0 * x + 3.0 * y + 0.2 * y * y + 0.1 * x * y + 0.2 * math.sqrt(abs(x))
+    ret += (20.0 * math.sin(6.0 * x * PI) + 20.0 * math.sin(2.0 * x * PI)) * 2.0 / 3.0
+    ret += (20.0 * math.sin(y * PI) + 40.0 * math.sin(y / 3.0 * PI)) * 2.0 / 3.0
+    ret += (160.0 * math.sin(y / 12.0 * PI) + 320 * math.sin(y * PI / 30.0)) * 2.0 / 3.0
+    return ret
+
+def transform_lng(x, y):
+    """计算经度偏移量"""
+    PI = math.pi
+    ret = 300.0 + x + 2.0 * y + 0.1 * x * x + 0.1 * x * y + 0.1 * math.sqrt(abs(x))
+    ret += (20.0 * math.sin(6.0 * x * PI) + 20.0 * math.sin(2.0 * x * PI)) * 2.0 / 3.0
+    ret += (20.0 * math.sin(x * PI) + 40.0 * math.sin(x / 3.0 * PI)) * 2.0 / 3.0
+    ret += (150.0 * math.sin(x / 12.0 * PI) + 300.0 * math.sin(x / 30.0 * PI)) * 2.0 / 3.0
+    return ret
+
+def out_of_china(lng, lat):
+    """判断坐标是否在国外"""
+    return (lng < 72.004 or lng > 137.8347) or (lat < 0.8293 or lat > 55.8271)
+
+def wgs84_to_gcj02_batch(lngs, lats):
+    """批量将WGS-84坐标转换为GCJ-02坐标，返回 (gcj_lngs, gcj_lats)
+
+    安装了NumPy时一次性向量化计算并返回数组，否则逐点计算并返回列表；
+    国外的坐标原样返回，结果与wgs84_to_gcj02逐点计算一致（误差小于1e-9度）。
+    """
+    if np is None:
+        pairs = [wgs84_to_gcj02(lng, lat) for lng, lat in zip(lngs, lats)]
+        return [pair[0] for pair in pairs], [pair[1] for pair in pairs]
+
+    PI = math.pi
+    a = 6378137.0
+    ee = 0.00669342162296594323
+    lng = np.asarray(lngs, dtype=np.float64)
+    lat = np.asarray(lats, dtype=np.float64)
+    x = lng - 105.0
+    y = lat - 35.0
+
+    # 与transform_lat/transform_lng相同的公式，按数组逐元素计算
+    common = (20.0 * np.sin(6.0 * x * PI) + 20.0 * np.sin(2.0 * x * PI)) * 2.0 / 3.0
+    d_lat = -100.0 + 2.0 * x + 3.0 * y + 0.2 * y * y + 0.1 * x * y + 0.2 * np.sqrt(np.abs(x)) + common
+    d_lat += (20.0 * np.sin(y * PI) + 40.0 * np.sin(y / 3.0 * PI)) * 2.0 / 3.0
+    d_lat += (160.0 * np.sin(y / 12.0 * PI) + 320 * np.sin(y * PI / 30.0)) * 2.0 / 3.0
+    d_lng = 300.0 + x + 2.0 * y + 0.1 * x * x + 0.1 * x * y + 0.1 * np.sqrt(np.abs(x)) + common
+    d_lng += (20.0 * np.sin(x * PI) + 40.0 * np.sin(x / 3.0 * PI)) * 2.0 / 3.0
+    d_lng += (150.0 * np.sin(x / 12.0 * PI) + 300.0 * np.sin(x / 30.0 * PI)) * 2.0 / 3.0
+
+    rad_lat = lat / 180.0 * PI
+    magic = np.sin(rad_lat)
+    magic = 1 - ee * magic * magic
+    sqrt_magic = np.sqrt(magic)
+    d_lat = (d_lat * 180.0) / ((a * (1 - ee)) / (magic * sqrt_magic) * PI)
+    d_lng = (d_lng * 180.0) / (a / sqrt_magic * np.cos(rad_lat) * PI)
+
+    outside = (lng < 72.004) | (lng > 137.8347) | (lat < 0.8293) | (lat > 55.8271)
+    return np.where(outside, lng, lng + d_lng), np.where(outside, lat, lat + d_lat)
+
+def to_gcj02(lat, lng):
+    """将日志中的原始经纬度（可能是字符串或'N/A'）转换为GCJ-02坐标，无法转换时返回None"""
+    if lat == 'N/A' or lng == 'N/A':
+        return None
+    try:
+        return wgs84_to_gcj02(float(lng), float(lat))
+    except (TypeError, ValueError):
+        return None
+
+def to_gcj02_many(lats, lngs):
+    """批量版本的to_gcj02：返回与输入等长的列表，每项为 (gcj_lng, gcj_lat) 或None"""
+    results = [None] * len(lats)
+    positions = []
+    valid_lngs = []
+    valid_lats = []
+    for position, (lat, lng) in enumerate(zip(lats, lngs)):
+        if lat == 'N/A' or lng == 'N/A':
+            continue
+        try:
+            lng_value, lat_value = float(lng), float(lat)
+        except (TypeError, ValueError):
+            continue
+        positions.append(position)
+        valid_lngs.append(lng_value)
+        valid_lats.append(lat_value)
+    if positions:
+        gcj_lngs, gcj_lats = wgs84_to_gcj02_batch(valid_lngs, valid_lats)
+        for position, gcj_lng, gcj_lat in zip(positions, gcj_lngs, gcj_lats):
+            results[position] = (float(gcj_lng), float(gcj_lat))
+    return results
+
+def amap_marker_url(lat, lng, gcj=False):
+    """生成高德地图标注链接：坐标有效时使用GCJ-02坐标，转换失败时使用原始坐标，没有坐标时返回'#'
+
+    gcj为已经转换好的to_gcj02结果时不再重复转换。
+    """
+    if lat == 'N/A' or lng == 'N/A':
+        return "#"
+    if gcj is False:
+        gcj = to_gcj02(lat, lng)
+    if gcj is None:
+        return AMAP_MARKER_URL.format(lng=lng, lat=lat)
+    return AMAP_MARKER_URL.format(lng=f"{gcj[0]:.6f}", lat=f"{gcj[1]:.6f}")
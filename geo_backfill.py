@@ -0,0 +1,143 @@
+"""批量补充历史日志的IP地理信息：访问时查询失败的记录country/region/city/isp为'N/A'
+
+流式读取日志存储，收集缺少地理信息的不同IP，用有限的并发通过IP查询（离线数据库、共享缓存、外部服务）解析，
+最后一次性写回存储。每个解析完成的IP都追加到检查点文件，中断后重新运行会跳过已解析的IP。
+
+用法：python geo_backfill.py device_info.jsonl --workers 16
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ip_database import IPRangeDatabase
+from ip_lookup import IPCache, IPLookup, SqliteIPCache, configure_http, get_ip_details
+from log_store import open_log_store
+
+logger = logging.getLogger(__name__)
+
+GEO_FIELDS = ('country', 'region', 'city', 'isp')
+
+
+def needs_geo(log):
+    """日志有公网IP但地理字段全部为空（访问时查询失败）时返回True"""
+    if log.get('public_ip', 'N/A') in ('N/A', '', None):
+        return False
+    return all(log.get(field, 'N/A') in ('N/A', '', None) for field in GEO_FIELDS)
+
+
+def collect_ips(store):
+    """流式读取全部日志，返回缺少地理信息的不同IP（按首次出现的顺序）和对应的记录数"""
+    ips = {}
+    records = 0
+    for log in store.iter_logs():
+        if needs_geo(log):
+            records += 1
+            ips.setdefault(log['public_ip'], None)
+    return list(ips), records
+
+
+def load_checkpoint(path):
+    """读取检查点文件，返回 {ip: 查询结果}；文件末尾写了一半的行会被忽略"""
+    resolved = {}
+    if not os.path.exists(path):
+        return resolved
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+                resolved[item['ip']] = item['details']
+            except (ValueError, KeyError):
+                continue
+    return resolved
+
+
+def fill_geo(log, resolved):
+    """用查询结果补充日志中为'N/A'的地理字段（原地修改），返回是否修改"""
+    if not needs_geo(log):
+        return False
+    details = resolved.get(log['public_ip'])
+    if not details:
+        return False
+    changed = False
+    for field in GEO_FIELDS:
+        value = details.get(field, 'N/A')
+        if log.get(field, 'N/A') in ('N/A', '', None) and value not in ('N/A', '', None):
+            log[field] = value
+            changed = True
+    return changed
+
+
+def resolve_ips(ips, lookup, checkpoint, workers=16, progress_interval=2.0):
+    """用workers个线程解析IP，成功的结果追加到检查点文件，返回 {ip: 查询结果}"""
+    resolved = {}
+    total = len(ips)
+    done_count = 0
+    start = last_report = time.monotonic()
+    pending = {}  # Future -> ip
+    position = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor, open(checkpoint, 'a', encoding='utf-8') as f:
+        while position < total or pending:
+            # 同时提交的任务不超过线程数的两倍，内存占用与IP总数无关
+            while position < total and len(pending) < workers * 2:
+                ip = ips[position]
+                pending[executor.submit(lookup.lookup, ip)] = ip
+                position += 1
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                ip = pending.pop(future)
+                done_count += 1
+                try:
+                    details = future.result()
+                except Exception as e:
+                    logger.error(f"查询IP {ip} 失败: {e}")
+                    continue
+                if details:
+                    resolved[ip] = details
+                    f.write(json.dumps({'ip': ip, 'details': details}, ensure_ascii=False) + '\n')
+            now = time.monotonic()
+            if now - last_report >= progress_interval or done_count == total:
+                f.flush()
+                rate = done_count / max(now - start, 1e-9)
+                print(f"已解析 {done_count}/{total} 个IP，成功 {len(resolved)} 个，{rate:.1f} 个/秒", file=sys.stderr)
+                last_report = now
+    return resolved
+
+
+def backfill_geo(path, workers=16, checkpoint=None, cache_db='ip_cache.db', offline_db='ip_ranges.db'):
+    """补充path日志存储中缺少的地理信息，返回 (更新的记录数, 解析成功的IP数)"""
+    store = open_log_store(path)
+    checkpoint = checkpoint or f"{path.rstrip('/')}.geo-checkpoint.jsonl"
+    ips, records = collect_ips(store)
+    resolved = load_checkpoint(checkpoint)
+    todo = [ip for ip in ips if ip not in resolved]
+    print(f"{records} 条记录缺少地理信息，涉及 {len(ips)} 个IP，检查点中已有 {len(ips) - len(todo)} 个", file=sys.stderr)
+
+    if todo:
+        configure_http(pool_size=workers)
+        database = IPRangeDatabase(offline_db) if offline_db and os.path.exists(offline_db) else None
+        shared_cache = SqliteIPCache(cache_db) if cache_db else None
+        lookup = IPLookup(IPCache(), shared_cache, get_ip_details, database)
+        resolved.update(resolve_ips(todo, lookup, checkpoint, workers))
+
+    # 所有记录在一次重写中更新（SQLite只更新被修改的行，分段存储只重写被修改的分段）
+    changed = store.rewrite(lambda log: fill_geo(log, resolved)) if resolved else 0
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return changed, len(resolved)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    parser = argparse.ArgumentParser(description='批量补充历史日志的IP地理信息')
+    parser.add_argument('path', nargs='?', default='device_info.jsonl')
+    parser.add_argument('--workers', type=int, default=16, help='同时查询的IP数')
+    parser.add_argument('--checkpoint', help='检查点文件，默认为<path>.geo-checkpoint.jsonl')
+    parser.add_argument('--cache-db', default=os.environ.get('IP_CACHE_DB', 'ip_cache.db'), help='共享的IP查询缓存，空字符串表示不使用')
+    parser.add_argument('--offline-db', default=os.environ.get('IP_OFFLINE_DB', 'ip_ranges.db'), help='离线IP数据库')
+    args = parser.parse_args()
+    changed, resolved = backfill_geo(args.path, args.workers, args.checkpoint, args.cache_db, args.offline_db)
+    print(f"已为 {changed} 条记录补充地理信息（解析成功 {resolved} 个IP）: {args.path}")
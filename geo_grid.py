@@ -0,0 +1,122 @@
+"""访客分布网格：按geohash把日志坐标归入网格，增量维护各网格的访问次数，用于绘制分布热力图
+
+只保存不超过max_precision的网格（默认4位，约39km×20km，相当于城市级别），不会暴露更精确的位置。
+"""
+from collections import Counter
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+_GEOHASH_INDEX = {char: index for index, char in enumerate(GEOHASH_ALPHABET)}
+
+
+def _spread_bits(value):
+    """把32位整数的各位间隔展开（第i位移到第2i位），用于交错经纬度的二进制位"""
+    value &= 0xFFFFFFFF
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    value = (value | (value << 1)) & 0x5555555555555555
+    return value
+
+
+def _bit_counts(precision):
+    """geohash各精度的经度、纬度二进制位数（从经度开始交替，经度位数不少于纬度）"""
+    bits = 5 * precision
+    return (bits + 1) // 2, bits // 2
+
+
+def _quantize(lat, lng, precision):
+    """把坐标量化为precision精度下的 (纬度序号, 经度序号)，与geohash逐位二分经纬度区间的结果一致"""
+    lng_bits, lat_bits = _bit_counts(precision)
+    lat_value = min(int((lat + 90.0) / 180.0 * (1 << lat_bits)), (1 << lat_bits) - 1)
+    lng_value = min(int((lng + 180.0) / 360.0 * (1 << lng_bits)), (1 << lng_bits) - 1)
+    return lat_value, lng_value
+
+
+def _cell_geohash(lat_value, lng_value, precision):
+    """交错经纬度序号的各位得到geohash：最高位是经度；总位数为偶数时最低位是纬度，为奇数时最低位是经度"""
+    bits = 5 * precision
+    if bits % 2:
+        value = _spread_bits(lng_value) | (_spread_bits(lat_value) << 1)
+    else:
+        value = (_spread_bits(lng_value) << 1) | _spread_bits(lat_value)
+    return ''.join(GEOHASH_ALPHABET[(value >> shift) & 31] for shift in range(bits - 5, -1, -5))
+
+
+def geohash_encode(lat, lng, precision):
+    """计算坐标的geohash（precision不超过12）"""
+    return _cell_geohash(*_quantize(lat, lng, precision), precision)
+
+
+def geohash_bounds(geohash):
+    """返回geohash网格的范围 (最小纬度, 最小经度, 最大纬度, 最大经度)"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _GEOHASH_INDEX[char]
+        for shift in range(4, -1, -1):
+            current = lng_range if even else lat_range
+            middle = (current[0] + current[1]) / 2
+            if value >> shift & 1:
+                current[0] = middle
+            else:
+                current[1] = middle
+            even = not even
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+
+def _coordinates(log):
+    """取日志的地图坐标：优先使用GCJ-02坐标（高德地图使用），没有时使用原始坐标，无效时返回None"""
+    for lat_field, lng_field in (('gcj_lat', 'gcj_lng'), ('latitude', 'longitude')):
+        try:
+            lat = float(log.get(lat_field, 'N/A'))
+            lng = float(log.get(lng_field, 'N/A'))
+        except (TypeError, ValueError):
+            continue
+        if -90 <= lat <= 90 and -180 <= lng <= 180:
+            return lat, lng
+    return None
+
+
+class GeoGrid:
+    """最高精度下各网格的访问次数，每条日志读入时只需量化坐标并计数一次；
+    较低精度的网格在查询时由最高精度的网格合并得到，与日志条数无关"""
+
+    def __init__(self, max_precision=4):
+        if not 1 <= max_precision <= 12:
+            raise ValueError(f"max_precision必须在1到12之间: {max_precision}")
+        self.max_precision = max_precision
+        self.cells = Counter()  # (纬度序号, 经度序号) -> 次数
+        self.total = 0  # 有有效坐标的日志数
+
+    def add(self, log):
+        """统计一条原始日志的坐标"""
+        coordinates = _coordinates(log)
+        if coordinates is None:
+            return
+        self.cells[_quantize(coordinates[0], coordinates[1], self.max_precision)] += 1
+        self.total += 1
+
+    def snapshot(self, precision=None):
+        """返回precision精度（不超过max_precision）的网格列表，按次数从多到少排列"""
+        precision = min(max(1, precision or self.max_precision), self.max_precision)
+        max_lng_bits, max_lat_bits = _bit_counts(self.max_precision)
+        lng_bits, lat_bits = _bit_counts(precision)
+        lat_shift = max_lat_bits - lat_bits
+        lng_shift = max_lng_bits - lng_bits
+        merged = Counter()
+        for (lat_value, lng_value), count in self.cells.items():
+            merged[lat_value >> lat_shift, lng_value >> lng_shift] += count
+        cells = []
+        for (lat_value, lng_value), count in merged.most_common():
+            geohash = _cell_geohash(lat_value, lng_value, precision)
+            min_lat, min_lng, max_lat, max_lng = geohash_bounds(geohash)
+            cells.append({
+                'geohash': geohash,
+                'count': count,
+                'lat': round((min_lat + max_lat) / 2, 6),
+                'lng': round((min_lng + max_lng) / 2, 6),
+                'bounds': [round(min_lat, 6), round(min_lng, 6), round(max_lat, 6), round(max_lng, 6)],
+            })
+        return {'precision': precision, 'max_precision': self.max_precision, 'total': self.total, 'cells': cells}
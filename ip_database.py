@@ -0,0 +1,185 @@
+"""离线IP地址段数据库：把CSV格式的IP地址段数据导入为紧凑的二进制文件，查询时内存映射该文件并二分查找
+
+CSV每行为：start,end,country,region,city,lat,lng,isp
+start/end可以是点分IP（IPv4/IPv6）或整数，首行为表头时自动跳过。
+
+文件格式：
+- 8字节文件头标识，4字节（小端）头部JSON长度，头部JSON（各段相对数据区的偏移量）
+- 每个地址族一段：按起始地址排序的起始地址数组、结束地址数组（大端定长字节，可直接按字节比较大小）、
+  位置记录编号数组（小端uint32）
+- 去重后的位置记录（JSON数组）
+"""
+import argparse
+import bisect
+import csv
+import ipaddress
+import json
+import mmap
+import os
+import struct
+
+MAGIC = b'IPRDB\x00\x01\x00'
+ADDRESS_WIDTH = {4: 4, 6: 16}  # 各地址族的地址字节数
+
+
+def _parse_address(value):
+    """把点分IP或整数解析为ipaddress对象"""
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return ipaddress.IPv4Address(number) if number <= 0xFFFFFFFF else ipaddress.IPv6Address(number)
+    return ipaddress.ip_address(value)
+
+
+def build_ip_database(csv_path, db_path):
+    """从CSV导入IP地址段，生成离线数据库文件，返回导入的地址段数"""
+    families = {4: [], 6: []}
+    records = []
+    record_ids = {}
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+        for line_number, row in enumerate(csv.reader(f), 1):
+            if not row or row[0].startswith('#'):
+                continue
+            try:
+                start = _parse_address(row[0])
+                end = _parse_address(row[1])
+            except (IndexError, ValueError):
+                if line_number == 1:
+                    continue  # 表头
+                raise ValueError(f"{csv_path} 第{line_number}行的IP地址无效: {row[:2]}")
+            if start.version != end.version or start > end:
+                raise ValueError(f"{csv_path} 第{line_number}行的地址段无效: {row[0]} - {row[1]}")
+            fields = [value.strip() for value in row[2:8]]
+            record = tuple(fields + [''] * (6 - len(fields)))
+            record_id = record_ids.get(record)
+            if record_id is None:
+                record_id = record_ids[record] = len(records)
+                records.append(record)
+            families[start.version].append((start.packed, end.packed, record_id))
+
+    header = {'families': {}, 'records': len(records)}
+    sections = []
+    for version, ranges in families.items():
+        ranges.sort()
+        sections.append((version, ranges))
+        header['families'][str(version)] = {'count': len(ranges)}
+
+    # 偏移量从头部之后的数据区开始计算
+    offset = 0
+    for version, ranges in sections:
+        header['families'][str(version)]['offset'] = offset
+        offset += len(ranges) * (2 * ADDRESS_WIDTH[version] + 4)
+    header['records_offset'] = offset
+    header_bytes = json.dumps(header).encode('utf-8')
+
+    tmp_path = db_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        for version, ranges in sections:
+            f.write(b''.join(start for start, _, _ in ranges))
+            f.write(b''.join(end for _, end, _ in ranges))
+            f.write(struct.pack(f'<{len(ranges)}I', *(record_id for _, _, record_id in ranges)))
+        f.write(json.dumps(records, ensure_ascii=False).encode('utf-8'))
+    os.replace(tmp_path, db_path)
+    return sum(len(ranges) for ranges in families.values())
+
+
+class _FixedWidthArray:
+    """把内存映射中的定长字节数组包装成序列，供bisect使用"""
+
+    def __init__(self, buffer, offset, count, width):
+        self._buffer = buffer
+        self._offset = offset
+        self._count = count
+        self._width = width
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        start = self._offset + index * self._width
+        return self._buffer[start:start + self._width]
+
+
+class IPRangeDatabase:
+    """内存映射的离线IP地址段数据库，查询为O(log n)"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"不是有效的离线IP数据库文件: {path}")
+        header_length = struct.unpack_from('<I', self._mmap, len(MAGIC))[0]
+        header_start = len(MAGIC) + 4
+        header = json.loads(bytes(self._mmap[header_start:header_start + header_length]))
+        data_start = header_start + header_length
+        self._families = {}
+        for version, info in header['families'].items():
+            version = int(version)
+            width = ADDRESS_WIDTH[version]
+            count = info['count']
+            offset = data_start + info['offset']
+            self._families[version] = (
+                _FixedWidthArray(self._mmap, offset, count, width),
+                _FixedWidthArray(self._mmap, offset + count * width, count, width),
+                offset + 2 * count * width,
+            )
+        # 位置记录去重后数量很少，直接载入内存
+        self._records = json.loads(bytes(self._mmap[data_start + header['records_offset']:]))
+        self.size = sum(len(starts) for starts, _, _ in self._families.values())
+
+    def lookup(self, ip):
+        """查询IP所在地址段的位置信息，返回与查询服务相同格式的结果，未找到时返回None"""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        family = self._families.get(address.version)
+        if family is None:
+            return None
+        starts, ends, ids_offset = family
+        key = address.packed
+        index = bisect.bisect_right(starts, key) - 1
+        if index < 0 or ends[index] < key:
+            return None
+        record_id = struct.unpack_from('<I', self._mmap, ids_offset + index * 4)[0]
+        country, region, city, lat, lng, isp = self._records[record_id]
+        return {
+            'ip': ip,
+            'country': country or 'N/A',
+            'region': region or 'N/A',
+            'city': city or 'N/A',
+            'loc': f"{lat},{lng}" if lat and lng else 'N/A',
+            'timezone': 'N/A',
+            'isp': isp or 'N/A'
+        }
+
+    def close(self):
+        """关闭内存映射"""
+        self._mmap.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='离线IP地址段数据库工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help='从CSV（start,end,country,region,city,lat,lng,isp）导入')
+    import_parser.add_argument('csv')
+    import_parser.add_argument('db', nargs='?', default='ip_ranges.db')
+
+    lookup_parser = subparsers.add_parser('lookup', help='查询IP')
+    lookup_parser.add_argument('ip')
+    lookup_parser.add_argument('--db', default='ip_ranges.db')
+
+    args = parser.parse_args()
+    if args.command == 'import':
+        count = build_ip_database(args.csv, args.db)
+        print(f"已导入 {count} 个IP地址段: {args.csv} -> {args.db}")
+    elif args.command == 'lookup':
+        print(json.dumps(IPRangeDatabase(args.db).lookup(args.ip), ensure_ascii=False))
@@ -0,0 +1,710 @@
+"""IP地理信息查询：依次（或对冲并发）请求多个IP查询服务
+
+配置了离线IP数据库（见ip_database.py）时优先查询离线数据库，未命中才请求外部服务。
+同一IP同时只有一个外部查询，并发的请求等待同一个结果；每次查询可以设置总时间预算，每个请求只使用剩余的预算，预算用完时返回空结果并标记为降级。
+查询结果先规范化为 {country, region, city, loc, timezone, isp}，再缓存在两层缓存中：
+进程内带过期时间的LRU缓存，以及所有工作进程共享、重启后仍然有效的SQLite缓存。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+# 各IP查询服务返回结果的解析函数：返回查询结果字典，响应不符合预期时返回None
+def _parse_pconline(ip, data):
+    """太平洋网络IP查询结果处理"""
+    if data and isinstance(data, dict):
+        return {
+            'ip': ip,
+            'country': '中国' if data.get('pro') else 'N/A',
+            'region': data.get('pro', 'N/A'),
+            'city': data.get('city', 'N/A'),
+            'loc': f"{data.get('lat', 'N/A')},{data.get('lng', 'N/A')}",
+            'timezone': data.get('timezone', 'N/A'),
+            'isp': data.get('isp', 'N/A')
+        }
+
+def _parse_vore(ip, data):
+    """国内IP查询API结果处理"""
+    if data.get('result', {}) == 200:  # 检查API是否返回成功
+        data = data.get('data', {})
+        if data and isinstance(data, dict):
+            return {
+                'ip': ip,
+                'country': data.get('country', 'N/A'),
+                'region': data.get('province', 'N/A'),
+                'city': data.get('city', 'N/A'),
+                'loc': f"{data.get('lat', 'N/A')},{data.get('lng', 'N/A')}",
+                'timezone': data.get('timezone', 'N/A'),
+                'isp': data.get('isp', 'N/A')
+            }
+
+def _parse_useragentinfo(ip, data):
+    """国内IP查询服务结果处理"""
+    if data.get('code', 0) == 200:  # 检查API是否返回成功
+        data = data.get('data', {})
+        if data and isinstance(data, dict):
+            return {
+                'ip': ip,
+                'country': data.get('country', 'N/A'),
+                'region': data.get('region', 'N/A'),
+                'city': data.get('city', 'N/A'),
+                'loc': f"{data.get('lat', 'N/A')},{data.get('lng', 'N/A')}",
+                'timezone': data.get('timezone', 'N/A'),
+                'isp': data.get('isp', 'N/A')
+            }
+
+def _parse_ipwhois_cn(ip, data):
+    """国内IPWHOIS查询服务结果处理"""
+    if data and isinstance(data, dict) and data.get('ret') == 'ok':
+        return {
+            'ip': ip,
+            'country': data.get('country', 'N/A'),
+            'region': data.get('province', 'N/A'),
+            'city': data.get('city', 'N/A'),
+            'loc': f"{data.get('lat', 'N/A')},{data.get('lng', 'N/A')}",
+            'timezone': data.get('timezone', 'N/A'),
+            'isp': data.get('isp', 'N/A')
+        }
+
+def _parse_ip_api(ip, data):
+    """IP-API查询结果处理"""
+    if data and isinstance(data, dict) and data.get('status') == 'success':
+        return {
+            'ip': ip,
+            'country': data.get('country', 'N/A'),
+            'region': data.get('regionName', 'N/A'),
+            'city': data.get('city', 'N/A'),
+            'loc': f"{data.get('lat', 'N/A')},{data.get('lon', 'N/A')}",
+            'timezone': data.get('timezone', 'N/A'),
+            'isp': data.get('isp', 'N/A')
+        }
+
+def _parse_ipgeolocation(ip, data):
+    """ipgeolocation.io结果处理"""
+    if data and isinstance(data, dict):
+        return {
+            'ip': ip,
+            'country': data.get('country_name', 'N/A'),
+            'region': data.get('state_prov', 'N/A'),
+            'city': data.get('city', 'N/A'),
+            'loc': f"{data.get('latitude', 'N/A')},{data.get('longitude', 'N/A')}",
+            'timezone': data.get('time_zone', {}).get('name', 'N/A'),
+            'isp': data.get('isp', 'N/A')
+        }
+
+def _parse_freeipapi(ip, data):
+    """freeipapi.com结果处理"""
+    if data and isinstance(data, dict):
+        return {
+            'ip': ip,
+            'country': data.get('countryName', 'N/A'),
+            'region': data.get('regionName', 'N/A'),
+            'city': data.get('cityName', 'N/A'),
+            'loc': f"{data.get('latitude', 'N/A')},{data.get('longitude', 'N/A')}",
+            'timezone': data.get('timeZone', 'N/A'),
+            'isp': data.get('isp', 'N/A')
+        }
+
+def _parse_db_ip(ip, data):
+    """DB-IP免费IP查询API结果处理"""
+    if data and isinstance(data, dict):
+        return {
+            'ip': ip,
+            'country': data.get('countryName', 'N/A'),
+            'region': data.get('stateProv', 'N/A'),
+            'city': data.get('city', 'N/A'),
+            'loc': f"{data.get('latitude', 'N/A')},{data.get('longitude', 'N/A')}",
+            'timezone': data.get('timeZone', 'N/A'),
+            'isp': data.get('isp', 'N/A')
+        }
+
+def _parse_raw(ip, data):
+    """字段名与返回结果一致的服务（ipinfo.io、ipapi.co等），直接使用返回结果"""
+    if data and isinstance(data, dict):
+        return data
+
+
+# IP地理信息服务列表：(名称, 请求地址, 解析函数)，按可靠性排序
+PROVIDERS = [
+    # 使用国内更可靠的IP查询服务
+    ('pconline', 'https://whois.pconline.com.cn/ipJson.jsp?ip={ip}&json=true', _parse_pconline),  # 太平洋网络IP查询
+    ('vore', 'https://api.vore.top/api/IPdata?ip={ip}', _parse_vore),  # 国内IP查询API
+    ('useragentinfo', 'https://ip.useragentinfo.com/json?ip={ip}', _parse_useragentinfo),  # 国内IP查询服务
+    ('ipwhois.cn', 'https://api.ipwhois.cn/?ip={ip}&json=true', _parse_ipwhois_cn),  # 国内IPWHOIS查询服务
+    ('ip-api', 'https://ip-api.com/json/{ip}?lang=zh-CN', _parse_ip_api),  # 国际IP查询API，支持中文
+    # 国际IP查询服务
+    ('ipinfo', 'https://ipinfo.io/{ip}/json', _parse_raw),
+    ('ipapi', 'https://ipapi.co/{ip}/json/', _parse_raw),
+    ('ipgeolocation', 'https://api.ipgeolocation.io/ipgeo?apiKey=32bcd4a6e4b548968e7afcdb682ac679&ip={ip}', _parse_ipgeolocation),  # 免费API
+    ('freeipapi', 'https://freeipapi.com/api/json/{ip}', _parse_freeipapi),  # 免费IP查询API
+    ('my-ip', 'https://api.my-ip.io/v2/ip.json?ip={ip}', _parse_raw),
+    ('db-ip', 'https://api.db-ip.com/v2/free/{ip}', _parse_db_ip),  # DB-IP免费IP查询API
+]
+
+
+# 每个查询服务的主机共用一个保持连接的Session，重复查询时不再重新进行DNS解析和TCP/TLS握手
+_http_settings = {'pool_size': 10, 'retries': 1, 'connect_timeout': 2}
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def configure_http(pool_size=10, retries=1, connect_timeout=2):
+    """设置连接池参数：每个主机的最大连接数、连接失败/网关错误时的重试次数、建立连接的超时（秒）"""
+    with _sessions_lock:
+        _http_settings.update(pool_size=pool_size, retries=retries, connect_timeout=connect_timeout)
+    close_sessions()
+
+
+def _get_session(url):
+    """返回url所在主机的Session，首次使用时创建"""
+    host = urlsplit(url).netloc
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host)
+            if session is None:
+                retries = _http_settings['retries']
+                retry = Retry(
+                    total=retries, connect=retries, read=0, status=retries,
+                    backoff_factor=0.1, status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset(['GET']), raise_on_status=False
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_http_settings['pool_size'], max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _sessions[host] = session
+    return session
+
+
+def close_sessions():
+    """关闭所有Session及其连接"""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+class ProviderHealth:
+    """查询服务的健康统计：滚动平均耗时与成功率、按预期耗时排序、熔断
+
+    连续失败failure_threshold次的服务熔断cooldown秒，期间不再请求；冷却结束后恢复尝试，
+    再次失败立即重新熔断。
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=60, alpha=0.2, default_latency=1.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.alpha = alpha  # 滚动平均的权重，越大越偏向最近的请求
+        self.default_latency = default_latency  # 还没有请求记录的服务的预估耗时（秒）
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = {
+                'requests': 0, 'successes': 0, 'failures': 0, 'consecutive_failures': 0,
+                'latency': None, 'success_rate': None, 'open_until': 0.0,
+            }
+        return stats
+
+    def record(self, name, success, elapsed):
+        """记录一次请求的结果和耗时（秒）"""
+        with self._lock:
+            stats = self._get(name)
+            stats['requests'] += 1
+            value = 1.0 if success else 0.0
+            if stats['latency'] is None:
+                stats['latency'] = elapsed
+                stats['success_rate'] = value
+            else:
+                stats['latency'] += self.alpha * (elapsed - stats['latency'])
+                stats['success_rate'] += self.alpha * (value - stats['success_rate'])
+            if success:
+                stats['successes'] += 1
+                stats['consecutive_failures'] = 0
+            else:
+                stats['failures'] += 1
+                stats['consecutive_failures'] += 1
+                if stats['consecutive_failures'] >= self.failure_threshold:
+                    if stats['open_until'] <= time.monotonic():
+                        logger.warning(f"IP查询服务 {name} 连续失败 {stats['consecutive_failures']} 次，熔断 {self.cooldown} 秒")
+                    stats['open_until'] = time.monotonic() + self.cooldown
+
+    def _cost(self, stats):
+        """预期耗时：平均耗时 / 成功率，没有记录时使用预估耗时"""
+        if stats['latency'] is None:
+            return self.default_latency
+        return stats['latency'] / max(stats['success_rate'], 0.05)
+
+    def ordered(self, providers):
+        """按预期耗时从小到大排列可用的服务，跳过熔断中的服务；全部熔断时按原顺序返回全部服务"""
+        now = time.monotonic()
+        with self._lock:
+            ranked = []
+            for position, provider in enumerate(providers):
+                stats = self._get(provider[0])
+                if stats['open_until'] > now:
+                    continue
+                ranked.append((self._cost(stats), position, provider))
+        if not ranked:
+            return list(providers)
+        ranked.sort(key=lambda item: item[:2])
+        return [provider for _, _, provider in ranked]
+
+    def query(self, provider, ip, timeout=5):
+        """请求一个查询服务并记录结果"""
+        start = time.monotonic()
+        details = query_provider(provider, ip, timeout)
+        self.record(provider[0], bool(details), time.monotonic() - start)
+        return details
+
+    def snapshot(self, providers=None):
+        """各服务的健康状况，按当前的请求顺序排列"""
+        providers = providers if providers is not None else PROVIDERS
+        order = {provider[0]: position for position, provider in enumerate(self.ordered(providers))}
+        now = time.monotonic()
+        result = []
+        with self._lock:
+            for provider in providers:
+                stats = self._get(provider[0])
+                open_for = max(0.0, stats['open_until'] - now)
+                result.append({
+                    'name': provider[0],
+                    'rank': order.get(provider[0]),
+                    'state': 'open' if open_for else 'closed',
+                    'open_for': round(open_for, 1),
+                    'requests': stats['requests'],
+                    'successes': stats['successes'],
+                    'failures': stats['failures'],
+                    'consecutive_failures': stats['consecutive_failures'],
+                    'latency_ms': round(stats['latency'] * 1000, 1) if stats['latency'] is not None else None,
+                    'success_rate': round(stats['success_rate'], 3) if stats['success_rate'] is not None else None,
+                    'expected_cost_ms': round(self._cost(stats) * 1000, 1),
+                })
+        result.sort(key=lambda item: (item['rank'] is None, item['rank'] if item['rank'] is not None else 0))
+        return result
+
+
+# 所有查询共用的服务健康统计
+provider_health = ProviderHealth()
+
+
+def configure_health(failure_threshold=5, cooldown=60):
+    """设置熔断参数：连续失败多少次后熔断，熔断多少秒"""
+    provider_health.failure_threshold = failure_threshold
+    provider_health.cooldown = cooldown
+
+
+def query_provider(provider, ip, timeout=5):
+    """向一个查询服务请求IP详情，成功时返回查询结果，失败或响应不符合预期时返回None"""
+    name, url, parser = provider
+    service = url.format(ip=ip)
+    try:
+        # 通过保持连接的Session发送请求，建立连接的超时较短，读取超时默认5秒
+        connect_timeout = min(_http_settings['connect_timeout'], timeout)
+        response = _get_session(service).get(service, timeout=(connect_timeout, timeout))
+        response.raise_for_status()  # 检查请求是否成功
+        
+        # 尝试解析JSON响应，按各服务的返回格式处理
+        return parser(ip, response.json())
+    except requests.RequestException as e:
+        # 记录请求异常
+        logger.debug(f"IP service {service} failed: {e}")
+    except ValueError as e:
+        # 记录JSON解析异常
+        logger.debug(f"JSON parsing failed for {service}: {e}")
+    except Exception as e:
+        # 记录其他异常
+        logger.debug(f"Unexpected error for {service}: {e}")
+    return None
+
+
+def get_ip_details(ip):
+    """按预期耗时依次尝试各查询服务（跳过熔断中的服务），返回第一个成功的查询结果，全部失败时返回空字典"""
+    for provider in provider_health.ordered(PROVIDERS):
+        details = provider_health.query(provider, ip)
+        if details:
+            return details
+    return {}
+
+
+class HedgedFetcher:
+    """对冲并发查询：先请求预期耗时最短的服务，hedge_delay秒内没有结果（或请求失败）就再请求下一个，
+    同时进行的请求不超过max_parallel个，采用最先返回的有效结果并取消其余尚未开始的请求
+
+    hedge_delay为0时相当于同时请求前max_parallel个服务。
+    """
+
+    def __init__(self, providers=None, max_parallel=3, hedge_delay=0.3, timeout=5, max_workers=32, health=None):
+        self.providers = providers if providers is not None else PROVIDERS
+        self.health = health if health is not None else provider_health
+        self.max_parallel = max(1, max_parallel)
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ip-lookup')
+
+    def __call__(self, ip):
+        """返回最先成功的查询结果，全部失败时返回空字典"""
+        providers = self.health.ordered(self.providers)
+        pending = set()
+        launched = 0
+        to_launch = 1
+        while True:
+            while to_launch > 0 and launched < len(providers) and len(pending) < self.max_parallel:
+                pending.add(self._executor.submit(self.health.query, providers[launched], ip, self.timeout))
+                launched += 1
+                to_launch -= 1
+            if not pending:
+                return {}
+
+            can_hedge = launched < len(providers) and len(pending) < self.max_parallel
+            done, pending = wait(pending, timeout=self.hedge_delay if can_hedge else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                details = future.result()
+                if details:
+                    # 取消尚未开始的请求，已经发出的请求在后台自行结束
+                    for other in pending:
+                        other.cancel()
+                    return details
+            # 失败的请求立即由下一个服务补上；超时未返回时再对冲一个请求
+            to_launch = len(done) or 1
+
+    def shutdown(self):
+        """关闭线程池"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+DETAIL_FIELDS = ('country', 'region', 'city', 'loc', 'timezone', 'isp')
+
+
+def normalize_details(data):
+    """将各查询服务的返回结果规范化为固定字段，查询失败（空结果）时返回空字典"""
+    if not data:
+        return {}
+    details = {field: data.get(field, 'N/A') for field in DETAIL_FIELDS}
+    # ipinfo.io等服务把运营商放在org字段
+    details['isp'] = data.get('org', details['isp'])
+    return details
+
+
+class IPCache:
+    """有容量上限和过期时间的LRU缓存，所有查询服务都失败的IP使用较短的过期时间（负缓存）"""
+
+    def __init__(self, maxsize=10000, ttl=3600, negative_ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._items = OrderedDict()  # ip -> (过期时间, 结果)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    def get(self, ip):
+        """返回 (是否命中, 结果)；命中负缓存时结果为空字典"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(ip)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._items[ip]
+                self.misses += 1
+                return False, None
+            self._items.move_to_end(ip)
+            self.hits += 1
+            if not item[1]:
+                self.negative_hits += 1
+            return True, item[1]
+
+    def put(self, ip, details, ttl=None):
+        """缓存查询结果，空结果按负缓存的过期时间保存；ttl用于指定剩余有效期"""
+        if ttl is None:
+            ttl = self.ttl if details else self.negative_ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._items[ip] = (time.monotonic() + ttl, details)
+            self._items.move_to_end(ip)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'negative_hits': self.negative_hits,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class SqliteIPCache:
+    """保存在SQLite中的IP查询结果缓存，多个工作进程共享，重启后仍然有效
+
+    超过max_entries条时先删除已过期的记录，再按过期时间从早到晚淘汰。
+    """
+
+    def __init__(self, path, max_entries=100000, ttl=86400, negative_ttl=300, evict_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.evict_every = evict_every
+        self._local = threading.local()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS ip_cache ('
+                'ip TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL, updated REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_ip_cache_expires ON ip_cache (expires)')
+
+    def _connect(self):
+        """每个线程使用独立的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, ip):
+        """返回 (是否命中, 结果, 剩余有效期秒数)"""
+        try:
+            row = self._connect().execute(
+                'SELECT data, expires FROM ip_cache WHERE ip = ? AND expires > ?', (ip, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.error(f"读取IP缓存数据库失败: {e}")
+            return False, None, 0
+        if row is None:
+            self.misses += 1
+            return False, None, 0
+        self.hits += 1
+        return True, json.loads(row[0]), row[1] - time.time()
+
+    def put(self, ip, details):
+        """保存查询结果，空结果按负缓存的过期时间保存"""
+        ttl = self.ttl if details else self.negative_ttl
+        if ttl <= 0:
+            return
+        now = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO ip_cache (ip, data, expires, updated) VALUES (?, ?, ?, ?)',
+                    (ip, json.dumps(details, ensure_ascii=False), now + ttl, now)
+                )
+            self._puts += 1
+            if self._puts % self.evict_every == 0:
+                self.evict()
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.error(f"写入IP缓存数据库失败: {e}")
+
+    def evict(self):
+        """删除过期记录，超出容量时淘汰最早过期的记录，返回删除的条数"""
+        conn = self._connect()
+        with conn:
+            deleted = conn.execute('DELETE FROM ip_cache WHERE expires <= ?', (time.time(),)).rowcount
+            excess = conn.execute('SELECT COUNT(*) FROM ip_cache').fetchone()[0] - self.max_entries
+            if excess > 0:
+                deleted += conn.execute(
+                    'DELETE FROM ip_cache WHERE ip IN (SELECT ip FROM ip_cache ORDER BY expires LIMIT ?)', (excess,)
+                ).rowcount
+        return deleted
+
+    def load_recent(self, limit):
+        """返回最近写入且未过期的limit条记录：[(ip, 结果, 剩余有效期秒数)]，用于启动时预热进程内缓存"""
+        now = time.time()
+        rows = self._connect().execute(
+            'SELECT ip, data, expires FROM ip_cache WHERE expires > ? ORDER BY updated DESC LIMIT ?', (now, limit)
+        ).fetchall()
+        return [(ip, json.loads(data), expires - now) for ip, data, expires in rows]
+
+    def stats(self):
+        """缓存统计信息"""
+        try:
+            size = self._connect().execute('SELECT COUNT(*) FROM ip_cache').fetchone()[0]
+        except sqlite3.Error:
+            size = None
+        return {
+            'path': self.path,
+            'size': size,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+        }
+
+
+class IPLookup:
+    """IP详情查询：离线IP数据库 -> 进程内LRU缓存 -> 共享的SQLite缓存 -> 外部查询服务"""
+
+    def __init__(self, cache=None, shared_cache=None, fetch=None, offline_db=None, budget=None, background_workers=8,
+                 max_background=64):
+        self.cache = cache if cache is not None else IPCache()
+        self.shared_cache = shared_cache
+        self.fetch = fetch or get_ip_details  # 查询外部服务的函数：ip -> 查询结果
+        self.offline_db = offline_db  # 离线IP地址段数据库（ip_database.IPRangeDatabase）
+        self.budget = budget  # 请求等待外部查询的时间预算（秒），None表示不限制；超出时查询在后台继续
+        self.offline_hits = 0
+        self.offline_misses = 0
+        self.degraded = 0
+        self.coalesced = 0  # 等待其他请求正在进行的同一IP查询的次数
+        self.overloaded = 0  # 进行中的外部查询已达上限，没有发起查询直接返回降级结果的次数
+        self._inflight = {}  # ip -> 正在进行的外部查询的Future
+        self._inflight_lock = threading.Lock()
+        self.background_workers = background_workers
+        self.max_background = max_background  # 有时间预算时同时进行（包括排队等待线程）的外部查询上限
+        self._executor = None  # 有时间预算时在该线程池中查询外部服务，超出预算的查询在后台继续完成
+
+    def warm_up(self):
+        """启动时从共享缓存加载最近的查询结果到进程内缓存，返回加载的条数"""
+        if self.shared_cache is None:
+            return 0
+        try:
+            # 按写入时间倒序返回，倒序放入使最近的结果留在LRU末尾
+            items = self.shared_cache.load_recent(self.cache.maxsize)
+        except sqlite3.Error as e:
+            logger.error(f"预热IP缓存失败: {e}")
+            return 0
+        for ip, details, ttl in reversed(items):
+            self.cache.put(ip, details, ttl=min(ttl, self.cache.ttl if details else self.cache.negative_ttl))
+        return len(items)
+
+    def lookup(self, ip):
+        """查询IP的规范化详情，离线数据库和缓存都未命中时才请求外部查询服务；返回的字典不要修改"""
+        return self.resolve(ip)[0]
+
+    def cached(self, ip):
+        """只查询离线数据库和两层缓存，返回 (是否命中, 规范化详情)"""
+        if self.offline_db is not None:
+            details = self.offline_db.lookup(ip)
+            if details:
+                self.offline_hits += 1
+                return True, normalize_details(details)
+            self.offline_misses += 1
+        found, details = self.cache.get(ip)
+        if found:
+            return True, details
+        if self.shared_cache is not None:
+            found, details, ttl = self.shared_cache.get(ip)
+            if found:
+                self.cache.put(ip, details, ttl=min(ttl, self.cache.ttl if details else self.cache.negative_ttl))
+                return True, details
+        return False, None
+
+    def store(self, ip, details):
+        """把外部查询服务的规范化结果写入两层缓存"""
+        self.cache.put(ip, details)
+        if self.shared_cache is not None:
+            self.shared_cache.put(ip, details)
+
+    def deadline(self, budget=None):
+        """返回 (时间预算, 截止时间)，budget默认使用self.budget，不限制时截止时间为None"""
+        budget = budget if budget is not None else self.budget
+        return budget, time.monotonic() + budget if budget else None
+
+    def resolve(self, ip, budget=None):
+        """返回 (规范化详情, 是否降级)；超出时间预算（默认使用self.budget）时返回空结果，查询在后台继续完成并写入缓存"""
+        found, details = self.cached(ip)
+        if found:
+            return details, False
+        budget, deadline = self.deadline(budget)
+
+        # 同一IP已有查询在进行时等待它的结果，不再重复请求外部服务
+        with self._inflight_lock:
+            future = self._inflight.get(ip)
+            leader = future is None
+            if not leader:
+                self.coalesced += 1
+            elif deadline is not None and len(self._inflight) >= self.max_background:
+                # 大量新IP同时到来时不再排队，避免积压越来越多、写入缓存越来越晚
+                self.degraded += 1
+                self.overloaded += 1
+                logger.debug(f"进行中的IP查询已达上限 {self.max_background}，IP {ip} 返回降级结果")
+                return {}, True
+            else:
+                future = self._inflight[ip] = Future()
+        if leader:
+            if deadline is None:
+                self._fetch(ip, future)
+            else:
+                self._get_executor().submit(self._fetch, ip, future)
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()) if deadline is not None else None), False
+        except FutureTimeoutError:
+            self.degraded += 1
+            logger.warning(f"查询IP {ip} 超出时间预算 {budget} 秒，返回降级结果，查询在后台继续")
+            return {}, True
+
+    def _get_executor(self):
+        """首次需要时创建后台查询线程池"""
+        if self._executor is None:
+            with self._inflight_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.background_workers, thread_name_prefix='ip-fetch')
+        return self._executor
+
+    def _fetch(self, ip, future):
+        """请求外部查询服务（使用各服务完整的超时）并写入缓存，把结果交给等待中的请求"""
+        try:
+            details = normalize_details(self.fetch(ip))
+            self.store(ip, details)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(details)
+        finally:
+            # 结果写入缓存之后才移除，之后的请求直接命中缓存
+            with self._inflight_lock:
+                self._inflight.pop(ip, None)
+
+    def stats(self):
+        """查询统计信息"""
+        stats = {'cache': self.cache.stats(), 'providers': provider_health.snapshot(), 'degraded': self.degraded,
+                 'coalesced': self.coalesced, 'overloaded': self.overloaded, 'inflight': len(self._inflight)}
+        if self.shared_cache is not None:
+            stats['shared_cache'] = self.shared_cache.stats()
+        if self.offline_db is not None:
+            stats['offline_db'] = {
+                'path': self.offline_db.path,
+                'ranges': self.offline_db.size,
+                'hits': self.offline_hits,
+                'misses': self.offline_misses,
+            }
+        return stats
@@ -0,0 +1,147 @@
+"""IP地理信息的异步查询：在事件循环中用httpx请求外部查询服务，一个进程可以同时进行大量查询
+
+缓存、离线数据库、服务健康统计和时间预算与同步查询（ip_lookup.py）共用，供asgi.py使用。
+需要额外安装httpx：pip install httpx
+"""
+import asyncio
+import logging
+import time
+
+import httpx
+
+from ip_lookup import PROVIDERS, _http_settings, normalize_details, provider_health
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncHedgedFetcher:
+    """异步的对冲并发查询，策略与ip_lookup.HedgedFetcher相同；max_parallel为1时即逐个请求
+
+    不再需要线程池：等待中的请求只占用一个协程，采用某个结果后其余请求直接取消。
+    """
+
+    def __init__(self, providers=None, max_parallel=3, hedge_delay=0.3, timeout=5, health=None):
+        self.providers = providers if providers is not None else PROVIDERS
+        self.health = health if health is not None else provider_health
+        self.max_parallel = max(1, max_parallel)
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+        self._client = None
+
+    def _get_client(self):
+        """首次使用时创建共用的异步HTTP客户端（保持连接，连接失败时重试）"""
+        if self._client is None:
+            limits = httpx.Limits(
+                max_connections=None,
+                max_keepalive_connections=_http_settings['pool_size'] * len(self.providers),
+            )
+            transport = httpx.AsyncHTTPTransport(retries=_http_settings['retries'], limits=limits)
+            self._client = httpx.AsyncClient(transport=transport)
+        return self._client
+
+    async def query(self, provider, ip, timeout=5):
+        """请求一个查询服务并记录结果，失败或响应不符合预期时返回None"""
+        name, url, parser = provider
+        service = url.format(ip=ip)
+        start = time.monotonic()
+        details = None
+        try:
+            connect_timeout = min(_http_settings['connect_timeout'], timeout)
+            response = await self._get_client().get(service, timeout=httpx.Timeout(timeout, connect=connect_timeout))
+            response.raise_for_status()
+            details = parser(ip, response.json())
+        except httpx.HTTPError as e:
+            logger.debug(f"IP service {service} failed: {e}")
+        except ValueError as e:
+            logger.debug(f"JSON parsing failed for {service}: {e}")
+        except Exception as e:
+            logger.debug(f"Unexpected error for {service}: {e}")
+        self.health.record(name, bool(details), time.monotonic() - start)
+        return details
+
+    async def __call__(self, ip):
+        """返回最先成功的查询结果，全部失败时返回空字典"""
+        providers = self.health.ordered(self.providers)
+        pending = set()
+        launched = 0
+        to_launch = 1
+        try:
+            while True:
+                while to_launch > 0 and launched < len(providers) and len(pending) < self.max_parallel:
+                    pending.add(asyncio.ensure_future(self.query(providers[launched], ip, self.timeout)))
+                    launched += 1
+                    to_launch -= 1
+                if not pending:
+                    return {}
+
+                can_hedge = launched < len(providers) and len(pending) < self.max_parallel
+                done, pending = await asyncio.wait(pending, timeout=self.hedge_delay if can_hedge else None,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    details = task.result()
+                    if details:
+                        return details
+                # 失败的请求立即由下一个服务补上；超时未返回时再对冲一个请求
+                to_launch = len(done) or 1
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def aclose(self):
+        """关闭HTTP客户端及其连接"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class AsyncIPLookup:
+    """异步IP详情查询：命中离线数据库或缓存时直接返回，否则异步请求外部服务
+
+    lookup为同步的ip_lookup.IPLookup，缓存、时间预算和统计信息都与它共用；
+    同一IP同时只有一个外部查询，并发的请求等待同一个结果。
+    """
+
+    def __init__(self, lookup, fetch):
+        self.lookup = lookup
+        self.fetch = fetch  # 异步查询函数：ip -> 查询结果
+        self._inflight = {}  # ip -> 正在进行的外部查询的Task
+
+    async def resolve(self, ip, budget=None):
+        """返回 (规范化详情, 是否降级)；超出时间预算时返回空结果，查询在后台继续完成并写入缓存"""
+        # 离线数据库（内存映射）和共享的SQLite缓存会读磁盘，放到线程中查询，不阻塞事件循环
+        found, details = await asyncio.to_thread(self.lookup.cached, ip)
+        if found:
+            return details, False
+        budget, deadline = self.lookup.deadline(budget)
+
+        task = self._inflight.get(ip)
+        if task is None:
+            if deadline is not None and len(self._inflight) >= self.lookup.max_background:
+                # 大量新IP同时到来时不再发起查询，避免积压越来越多、写入缓存越来越晚
+                self.lookup.degraded += 1
+                self.lookup.overloaded += 1
+                logger.debug(f"进行中的IP查询已达上限 {self.lookup.max_background}，IP {ip} 返回降级结果")
+                return {}, True
+            task = self._inflight[ip] = asyncio.ensure_future(self._fetch(ip))
+            # 没有请求等待时（全部超出预算）避免"exception was never retrieved"警告
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        else:
+            self.lookup.coalesced += 1
+        try:
+            # shield：等待超时或发起请求的客户端断开都不会取消查询本身
+            timeout = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+            return await asyncio.wait_for(asyncio.shield(task), timeout), False
+        except asyncio.TimeoutError:
+            self.lookup.degraded += 1
+            logger.warning(f"查询IP {ip} 超出时间预算 {budget} 秒，返回降级结果，查询在后台继续")
+            return {}, True
+
+    async def _fetch(self, ip):
+        """异步请求外部查询服务（使用各服务完整的超时）并写入缓存，返回规范化详情"""
+        try:
+            details = normalize_details(await self.fetch(ip))
+            await asyncio.to_thread(self.lookup.store, ip, details)
+            return details
+        finally:
+            # 结果写入缓存之后才移除，之后的请求直接命中缓存
+            self._inflight.pop(ip, None)
@@ -0,0 +1,72 @@
+"""日志接口的紧凑响应格式：列式存储和字典编码，以及按Accept-Encoding协商的gzip/brotli压缩
+
+列式格式中每个字段名只出现一次，同一列的值放在一个数组中；重复较多的字段（操作系统、浏览器、
+国家、ISP等）只发送一次不同的值，各行用整数序号引用：
+
+    {"format": "columnar", "count": 2, "fields": ["time", "os", ...],
+     "columns": [["2024-01-01 10:00:00", "2024-01-01 10:00:05"], [0, 0], ...],
+     "dictionaries": {"os": ["Windows 10"], ...}}
+
+安装了brotli（pip install brotli，可选）时优先使用brotli压缩，未安装时使用gzip。
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:  # brotli为可选依赖
+    brotli = None
+
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)  # 按优先顺序排列的压缩方式
+MIN_COMPRESS_SIZE = 1024  # 小于该字节数的响应不压缩
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # 在线压缩使用中等压缩级别，兼顾压缩率和耗时
+
+
+def encode_columnar(logs):
+    """把日志列表编码为列式格式；不同值不超过行数一半的列使用字典编码"""
+    fields = {}
+    for log in logs:
+        for field in log:
+            fields.setdefault(field, None)
+    columns = []
+    dictionaries = {}
+    for field in fields:
+        values = [log.get(field) for log in logs]
+        try:
+            index = {}
+            codes = [index.setdefault(value, len(index)) for value in values]
+        except TypeError:  # 不可哈希的值（列表、字典）不做字典编码
+            index = None
+        if index is not None and len(index) * 2 <= len(values):
+            dictionaries[field] = list(index)
+            columns.append(codes)
+        else:
+            columns.append(values)
+    return {
+        'format': 'columnar',
+        'count': len(logs),
+        'fields': list(fields),
+        'columns': columns,
+        'dictionaries': dictionaries
+    }
+
+
+def decode_columnar(data):
+    """把列式格式还原为日志列表"""
+    rows = [{} for _ in range(data['count'])]
+    for field, column in zip(data['fields'], data['columns']):
+        dictionary = data['dictionaries'].get(field)
+        if dictionary is not None:
+            column = [dictionary[code] for code in column]
+        for row, value in zip(rows, column):
+            row[field] = value
+    return rows
+
+
+def compress(data, encoding):
+    """用encoding（br或gzip）压缩字节串"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    raise ValueError(f"不支持的压缩方式: {encoding}")
@@ -0,0 +1,64 @@
+"""新日志推送：一个广播器唤醒所有已连接的后台页面，通过Server-Sent Events推送新日志和最新统计
+
+每个连接只保存自己的增量游标，被唤醒后从内存日志索引取游标之后的新日志，
+慢连接不会积压消息，空闲连接只是在条件变量上等待。
+"""
+import json
+import threading
+import time
+
+
+class LogBroadcaster:
+    """新日志广播器"""
+
+    def __init__(self, index, poll_interval=1.0, heartbeat_interval=15.0):
+        self.index = index
+        self.poll_interval = poll_interval  # 兜底轮询间隔，用于发现其他工作进程写入的日志
+        self.heartbeat_interval = heartbeat_interval
+        self._condition = threading.Condition()
+        self._seq = 0
+
+    def notify(self, *args):
+        """有新日志写入时唤醒所有等待中的连接（可直接作为写入线程的on_flush回调）"""
+        with self._condition:
+            self._seq += 1
+            self._condition.notify_all()
+
+    def _wait(self, seen, timeout):
+        """等待新的通知，超时后返回，返回当前通知序号"""
+        with self._condition:
+            if self._seq == seen:
+                self._condition.wait(timeout)
+            return self._seq
+
+    def stream(self, cursor=None, date=None, stats=None, page=None, encode=None):
+        """生成SSE事件流：先推送cursor之后的日志，之后每有新日志推送一次
+
+        date为YYYY-MM-DD时只推送当天的日志；stats为返回统计信息的函数；
+        page为返回当前页的函数（结果中包含当前页的logs、pagination、统计信息和对应的cursor），需要推送全量日志时只推送当前页；
+        encode为日志列表的编码函数（例如log_codec.encode_columnar）。
+        """
+        yield "retry: 3000\n\n"
+        last_sent = time.monotonic()
+        seen = self._seq
+        while True:
+            logs, cursor, full = self.index.get_since(cursor)
+            if date:
+                logs = [log for log in logs if log['time'].startswith(date)]
+            if full or logs:
+                payload = {'logs': logs, 'cursor': cursor, 'reset': full}
+                if full and page is not None:
+                    # 当前页与其游标一起取出，之后从该游标继续推送，新日志不会重复
+                    payload.update(page())
+                    cursor = payload['cursor']
+                elif stats is not None:
+                    payload.update(stats())
+                if encode is not None:
+                    payload['logs'] = encode(payload['logs'])
+                # id为游标，断线重连时浏览器通过Last-Event-ID带回，不会重复推送
+                yield f"id: {cursor}\nevent: logs\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= self.heartbeat_interval:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            seen = self._wait(seen, self.poll_interval)
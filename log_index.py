@@ -0,0 +1,291 @@
+"""进程内日志索引：启动后加载一次全部日志，之后只增量读取新写入的日志
+
+日志存储通过 read_since(cursor) 提供增量读取（JSONL按字节偏移、SQLite按rowid、
+分段存储按各分段偏移、JSON数组文件在文件变化时整体重读），读接口直接使用内存中的结果；
+统计信息（总数、独立IP、按天计数）和访客分布网格在读入时增量更新。
+"""
+import bisect
+import hashlib
+import logging
+import heapq
+import math
+import threading
+from collections import Counter
+from datetime import datetime
+
+from geo_grid import GeoGrid
+
+logger = logging.getLogger(__name__)
+
+
+UNIQUE_IP_MODES = ('exact', 'hll')
+SORT_FIELDS = ('time', 'ip', 'device_type', 'browser', 'os', 'country', 'region', 'city')  # 后台页面可以排序的列
+
+
+_MAX_SORTED_INSERTS = 1000  # 新日志不超过该条数时二分插入到缓存的排序结果中，否则重新排序
+
+
+def _sort_key(sort):
+    """排序键：统一按字符串比较，个别日志的字段不是字符串（例如手工编辑过的日志）时也能排序"""
+    return lambda log: str(log[sort])
+
+
+def _window(logs, offset, limit, descending):
+    """从正序排列的logs中取出按descending方向排列的第offset条开始的limit条"""
+    if not descending:
+        return logs[offset:offset + limit]
+    end = max(len(logs) - offset, 0)
+    return logs[max(end - limit, 0):end][::-1]
+
+
+def select_page(logs, offset, limit, sort='time', descending=True):
+    """从按时间倒序排列的日志中取出按sort字段排序后的一页，相同值按时间排序（方向与sort相同）"""
+    if sort == 'time':
+        # logs本身按时间倒序，从末尾倒着取即为按时间正序
+        return _window(logs, offset, limit, not descending)
+    # 稳定排序保持相同值之间原来的顺序，所以正序时先把日志翻转为按时间正序
+    ordered = logs if descending else logs[::-1]
+    key = _sort_key(sort)
+    if offset + limit < len(logs) // 8:
+        return (heapq.nlargest if descending else heapq.nsmallest)(offset + limit, ordered, key=key)[offset:]
+    return sorted(ordered, key=key, reverse=descending)[offset:offset + limit]
+
+
+class HyperLogLog:
+    """HyperLogLog基数估计：内存固定为2^precision字节，标准误差约1.04/sqrt(2^precision)"""
+
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 16:
+            raise ValueError(f"precision必须在4到16之间: {precision}")
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+        if self.size >= 128:
+            self.alpha = 0.7213 / (1 + 1.079 / self.size)
+        else:
+            self.alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.size]
+
+    def add(self, value):
+        """加入一个元素"""
+        x = int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def __len__(self):
+        """估计不同元素的个数"""
+        estimate = self.alpha * self.size * self.size / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # 小基数时使用线性计数修正
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+
+class LogStats:
+    """增量维护的统计信息：总数、独立IP数、每天的日志数"""
+
+    def __init__(self, unique_ips='exact'):
+        if unique_ips not in UNIQUE_IP_MODES:
+            raise ValueError(f"未知的独立IP统计方式: {unique_ips}")
+        self.total = 0
+        self.ips = set() if unique_ips == 'exact' else HyperLogLog()
+        self.per_day = Counter()  # 按天计数，跨天后"今日"自然切换到新的一天
+
+    def add(self, log):
+        """统计一条原始日志"""
+        self.total += 1
+        ip = log.get('public_ip', 'N/A')
+        if ip != 'N/A':
+            self.ips.add(ip)
+        self.per_day[str(log.get('timestamp', ''))[:10]] += 1
+
+    def snapshot(self, today=None):
+        """返回页面使用的统计数据"""
+        today = today or datetime.now().strftime('%Y-%m-%d')
+        return {
+            'total_logs': self.total,
+            'unique_ips': len(self.ips),
+            'today_logs': self.per_day.get(today, 0),
+        }
+
+
+class LogIndex:
+    """按时间排序的内存日志索引，每条日志只在首次读入时处理一次"""
+
+    def __init__(self, store, process=None, unique_ips='exact', prepare=None, geo_precision=4):
+        self.store = store
+        self.process = process or (lambda log: log)
+        self.prepare = prepare  # 逐条处理之前对整批新读入的原始日志调用一次（例如批量计算派生字段）
+        self.unique_ips = unique_ips
+        self.stats = LogStats(unique_ips)
+        self.geo_precision = geo_precision  # 访客分布网格的最高精度（geohash位数）
+        self.geo = GeoGrid(geo_precision)
+        self.version = 0  # 每次内容变化时递增
+        self.generation = 0  # 每次整体重新加载时递增，旧的增量游标随之失效
+        self._lock = threading.RLock()
+        self._cursor = None
+        self._loaded = False
+        self._seq = 0
+        self._keys = []     # 升序排列的 (时间戳, -读入顺序)
+        self._entries = []  # 与_keys一一对应的处理后日志
+        self._arrival = []  # 按读入顺序排列的处理后日志，用于增量游标
+        self._arrival_base = 0
+        self._newest_first = []
+        self._newest_first_version = -1
+        self._sorted = {}  # 排序字段 -> (generation, 已排序的读入位置, 按该字段正序排列的日志)
+
+    def refresh(self):
+        """从存储读取上次之后新写入的日志，返回本次新增的条目（重新加载时返回全部）"""
+        with self._lock:
+            try:
+                records, cursor, reset = self.store.read_since(self._cursor)
+            except Exception as e:
+                logger.error(f"增量读取日志失败: {e}")
+                return []
+            self._cursor = cursor
+            if reset:
+                self._keys = []
+                self._entries = []
+                self.stats = LogStats(self.unique_ips)
+                self.geo = GeoGrid(self.geo_precision)
+                self.generation += 1
+                self._arrival = []
+                self._arrival_base = self._seq
+            elif not records:
+                self._loaded = True
+                return []
+
+            if self.prepare is not None and records:
+                try:
+                    self.prepare(records)
+                except Exception as e:
+                    logger.error(f"批量预处理日志失败: {e}")
+            added = []
+            for log in records:
+                try:
+                    entry = self.process(log)
+                except Exception as e:
+                    logger.error(f"处理日志失败: {e}")
+                    continue
+                self._insert(log.get('timestamp') or '', entry)
+                self.stats.add(log)
+                self.geo.add(log)
+                added.append(entry)
+            if reset and self._loaded:
+                logger.info(f"日志存储已被重写，重新加载 {len(added)} 条日志")
+            self._loaded = True
+            self.version += 1
+            return added
+
+    def _insert(self, timestamp, entry):
+        """按时间插入；新日志一般是最新的，直接追加到末尾"""
+        self._seq += 1
+        self._arrival.append(entry)
+        # 相同时间戳按读入顺序倒序，翻转后与原来的稳定排序结果一致
+        key = (timestamp, -self._seq)
+        if not self._keys or key >= self._keys[-1]:
+            self._keys.append(key)
+            self._entries.append(entry)
+        else:
+            position = bisect.bisect(self._keys, key)
+            self._keys.insert(position, key)
+            self._entries.insert(position, entry)
+
+    def get_logs(self, date=None):
+        """返回按时间倒序排列的全部日志（共享列表，调用方不要修改）；指定date时二分查找当天的日志"""
+        self.refresh()
+        with self._lock:
+            if date:
+                lo, hi = self._date_range(date)
+                return self._entries[lo:hi][::-1]
+            return self._get_newest_first()
+
+    def get_page(self, offset, limit, date=None, sort='time', descending=True):
+        """返回 (排序后从第offset条开始的limit条日志, 符合条件的日志总数, 当前的增量游标)
+
+        按时间排序时直接按位置截取（指定date时先二分查找当天的范围），不复制也不排序全部日志；
+        按其他字段排序时使用缓存的排序结果。
+        """
+        self.refresh()
+        with self._lock:
+            if sort == 'time':
+                lo, hi = self._date_range(date)
+                if descending:
+                    end = max(hi - offset, lo)
+                    return self._entries[max(end - limit, lo):end][::-1], hi - lo, self._current_cursor()
+                start = min(lo + offset, hi)
+                return self._entries[start:min(start + limit, hi)], hi - lo, self._current_cursor()
+            logs = self._get_sorted(sort)
+            if date:
+                logs = [log for log in logs if log['time'].startswith(date)]
+            return _window(logs, offset, limit, descending), len(logs), self._current_cursor()
+
+    def _date_range(self, date):
+        """时间戳以date开头的日志在_entries中的范围 [lo, hi)"""
+        if not date:
+            return 0, len(self._entries)
+        return bisect.bisect_left(self._keys, (date,)), bisect.bisect_left(self._keys, (date + '\uffff',))
+
+    def _get_sorted(self, sort):
+        """按sort字段正序排列的全部日志（相同值按时间正序）；新日志不多时二分插入到上次的排序结果中"""
+        end = self._arrival_base + len(self._arrival)
+        cached = self._sorted.get(sort)
+        if cached is not None and cached[0] == self.generation and end - cached[1] <= _MAX_SORTED_INSERTS:
+            logs = cached[2]
+            value = _sort_key(sort)
+            key = lambda log: (value(log), str(log['time']))
+            for entry in self._arrival[cached[1] - self._arrival_base:]:
+                logs.insert(bisect.bisect(logs, key(entry), key=key), entry)
+        else:
+            # _entries按时间正序排列，稳定排序后相同值仍按时间正序
+            logs = sorted(self._entries, key=_sort_key(sort))
+        self._sorted[sort] = (self.generation, end, logs)
+        return logs
+
+    def _get_newest_first(self):
+        if self._newest_first_version != self.version:
+            self._newest_first = self._entries[::-1]
+            self._newest_first_version = self.version
+        return self._newest_first
+
+    def get_since(self, cursor=None):
+        """返回 (cursor之后新读入的日志（按时间倒序）, 新游标, 是否为全量)
+
+        游标格式为"generation-序号"；未指定游标、游标无效或日志被重写过时返回全部日志。
+        """
+        self.refresh()
+        with self._lock:
+            end = self._arrival_base + len(self._arrival)
+            current = self._current_cursor()
+            start = None
+            try:
+                generation, position = (int(part) for part in str(cursor).split('-'))
+                if generation == self.generation and self._arrival_base <= position <= end:
+                    start = position - self._arrival_base
+            except ValueError:
+                pass
+            if start is None:
+                return self._get_newest_first(), current, True
+            return self._arrival[start:][::-1], current, False
+
+    def _current_cursor(self):
+        return f"{self.generation}-{self._arrival_base + len(self._arrival)}"
+
+    def get_stats(self):
+        """返回统计信息，不需要遍历日志"""
+        self.refresh()
+        with self._lock:
+            return self.stats.snapshot()
+
+    def get_geo_grid(self, precision=None):
+        """返回访客分布网格，不需要遍历日志"""
+        self.refresh()
+        with self._lock:
+            return self.geo.snapshot(precision)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,887 @@
+"""日志存储模块：供app.py与log_viewer.py共用
+
+支持以下存储格式：
+- json：旧版JSON数组，每次写入都要读取并重写整个文件
+- jsonl：JSON Lines，每条记录一行，写入为O(1)追加
+- sqlite：WAL模式的SQLite数据库，按时间、IP、设备类型、平台建立索引
+- segments：按天/小时分段的JSON Lines目录，附带分段清单，按日期读取时只打开需要的分段
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from coord_transform import amap_marker_url, to_gcj02, to_gcj02_many
+
+logger = logging.getLogger(__name__)
+
+
+def detect_log_format(path):
+    """根据文件首个非空白字符判断日志格式，返回'json'、'jsonl'或None（空文件/不存在）"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        while True:
+            chunk = f.read(4096)
+            if not chunk:
+                return None
+            stripped = chunk.lstrip()
+            if stripped:
+                return 'json' if stripped[0] == '[' else 'jsonl'
+
+
+def _sort_key(log):
+    """排序键：按时间戳排序"""
+    return log.get('timestamp', '')
+
+
+def detect_platform(log):
+    """根据日志记录的操作系统信息推断平台"""
+    # 客户端可能提交null或数字，历史记录中也可能存在这样的值
+    os_name = str(log.get('os') or '').lower()
+    platform = str(log.get('platform') or '').lower()
+
+    if 'ios' in os_name or 'iphone' in os_name or 'ipad' in os_name:
+        return 'iOS'
+    elif 'android' in os_name:
+        return 'Android'
+    elif 'mac' in os_name or 'macos' in os_name:
+        return 'macOS'
+    elif 'win' in os_name or 'windows' in os_name:
+        return 'Windows'
+    elif 'linux' in os_name:
+        return 'Linux'
+    elif platform:
+        return platform.capitalize()
+    else:
+        return 'Unknown'
+
+
+# 写入时计算并随记录保存的派生字段
+DERIVED_FIELDS = ('gcj_lat', 'gcj_lng', 'map_url', 'platform_name', 'epoch')
+
+
+def add_derived_fields(log, force=False):
+    """计算GCJ-02坐标、高德地图链接、规范化平台和时间戳（秒）并写入记录，返回记录是否被修改
+
+    已有派生字段的记录默认跳过，force为True时重新计算。
+    """
+    if not force and all(field in log for field in DERIVED_FIELDS):
+        return False
+    _set_derived_fields(log, to_gcj02(log.get('latitude', 'N/A'), log.get('longitude', 'N/A')))
+    return True
+
+
+def add_derived_fields_many(logs, force=False):
+    """批量版本的add_derived_fields：所有坐标一次转换（安装了NumPy时向量化计算），返回被修改的记录数"""
+    todo = [log for log in logs if force or not all(field in log for field in DERIVED_FIELDS)]
+    if not todo:
+        return 0
+    gcjs = to_gcj02_many([log.get('latitude', 'N/A') for log in todo], [log.get('longitude', 'N/A') for log in todo])
+    for log, gcj in zip(todo, gcjs):
+        _set_derived_fields(log, gcj)
+    return len(todo)
+
+
+def _set_derived_fields(log, gcj):
+    """根据已转换的GCJ-02坐标（或None）写入派生字段"""
+    log['gcj_lat'] = round(gcj[1], 6) if gcj else 'N/A'
+    log['gcj_lng'] = round(gcj[0], 6) if gcj else 'N/A'
+    log['map_url'] = amap_marker_url(log.get('latitude', 'N/A'), log.get('longitude', 'N/A'), gcj)
+    log['platform_name'] = detect_platform(log)
+    try:
+        log['epoch'] = int(datetime.strptime(log.get('timestamp', ''), '%Y-%m-%d %H:%M:%S').timestamp())
+    except (TypeError, ValueError):
+        log['epoch'] = None
+
+
+_TIMESTAMP_RE = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}')
+
+
+def _entry_key(entry):
+    """日志内容的规范化表示，用于按内容匹配记录"""
+    return json.dumps(entry, ensure_ascii=False, sort_keys=True)
+
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _lock_file(f):
+        """对锁文件加排他锁（Windows）"""
+        f.seek(0)
+        while True:
+            try:
+                # LK_LOCK在失败前会自行重试10秒
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+
+    def _unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_file(f):
+        """对锁文件加排他锁（POSIX）"""
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(path):
+    """跨进程的排他文件锁（使用旁路的 .lock 文件），同一线程内可重入
+
+    多个Flask工作进程、日志查看器写同一个日志文件时，通过该锁串行化所有写操作。
+    """
+    lock_path = os.path.abspath(path) + '.lock'
+    with _file_locks_guard:
+        state = _file_locks.setdefault(lock_path, {'rlock': threading.RLock(), 'depth': 0, 'file': None})
+    with state['rlock']:
+        if state['depth'] == 0:
+            f = open(lock_path, 'a+b')
+            try:
+                _lock_file(f)
+            except BaseException:
+                f.close()
+                raise
+            state['file'] = f
+        state['depth'] += 1
+        try:
+            yield
+        finally:
+            state['depth'] -= 1
+            if state['depth'] == 0:
+                _unlock_file(state['file'])
+                state['file'].close()
+                state['file'] = None
+
+
+def _prefix_upper_bound(prefix):
+    """返回前缀匹配的上界，使 prefix <= value < upper 等价于 value.startswith(prefix)"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _date_matches(log, date):
+    """日志时间戳是否属于指定日期（YYYY-MM-DD）"""
+    return str(log.get('timestamp', '')).startswith(date)
+
+
+def _iter_jsonl_file(path):
+    """逐行流式读取JSON Lines文件，跳过空行、损坏的行和正在写入的末行"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.endswith('\n'):
+                # 末行没有换行符，说明其他进程还没写完
+                break
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                logger.warning(f"跳过损坏的日志行 {path}:{line_no}: {e}")
+
+
+def _append_jsonl_file(path, entries, fsync=False):
+    """向JSON Lines文件追加多行（调用方需持有文件锁）"""
+    data = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries).encode('utf-8')
+    with open(path, 'ab') as f:
+        # 上一个写入者中途崩溃留下不完整的行时，先补一个换行，避免新记录与其粘连
+        if f.tell() > 0:
+            with open(path, 'rb') as tail:
+                tail.seek(-1, os.SEEK_END)
+                if tail.read(1) != b'\n':
+                    data = b'\n' + data
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _write_jsonl_file(path, logs, fsync=False):
+    """按时间正序重写JSON Lines文件，先写临时文件再原子替换（调用方需持有文件锁）"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for log in sorted(logs, key=_sort_key):
+            f.write((json.dumps(log, ensure_ascii=False) + '\n').encode('utf-8'))
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _file_signature(path):
+    """文件的(修改时间, 大小, inode)，文件不存在时返回None"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _tail_jsonl_file(path, state):
+    """从state记录的字节偏移继续读取JSON Lines文件中新写入的完整行
+
+    返回 (新记录, 新状态, 是否重置)。state为None时从头读取；文件被整体重写（inode变化或变短）时
+    也从头读取，并返回重置标记，调用方应丢弃之前读到的内容。
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return [], None, state is not None
+    reset = state is not None and (state['ino'] != st.st_ino or st.st_size < state['offset'])
+    offset = 0 if state is None or reset else state['offset']
+    if not reset and st.st_size == offset:
+        return [], state, False
+
+    records = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                # 末行还没写完，下次再读
+                break
+            offset += len(line)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError as e:
+                logger.warning(f"跳过损坏的日志行 {path}@{offset}: {e}")
+    return records, {'ino': st.st_ino, 'offset': offset}, reset
+
+
+def _remove_matching(logs, entries):
+    """从logs中去掉与entries内容相同的记录（每条只去掉一次），返回(保留的记录, 删除条数)"""
+    pending = Counter(_entry_key(entry) for entry in entries)
+    kept = []
+    deleted = 0
+    for log in logs:
+        key = _entry_key(log)
+        if pending[key] > 0:
+            pending[key] -= 1
+            deleted += 1
+        else:
+            kept.append(log)
+    return kept, deleted
+
+
+class JsonArrayLogStore:
+    """旧版JSON数组存储，所有写操作都在文件锁内完成"""
+    format = 'json'
+
+    def __init__(self, path):
+        self.path = path
+
+    def _load_for_update(self):
+        """在持有文件锁时读取现有日志；文件损坏时抛出异常，避免覆盖掉已有数据"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            logs = json.load(f)
+        if not isinstance(logs, list):
+            raise ValueError(f"{self.path} 不是JSON数组")
+        return logs
+
+    def _write_atomic(self, logs, fsync=False):
+        """先写临时文件再原子替换，读取方不会看到写了一半的文件"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(logs, f, ensure_ascii=False, indent=2)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _iter_records(self):
+        """按写入顺序遍历文件中的全部日志"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            logs = json.load(f)
+        yield from logs
+
+    def append(self, entry):
+        """追加一条日志（需要读取并重写整个文件）"""
+        self.append_many([entry])
+
+    def append_many(self, entries, fsync=False):
+        """批量追加日志，整个文件只读写一次"""
+        with file_lock(self.path):
+            logs = self._load_for_update()
+            logs.extend(entries)
+            self._write_atomic(logs, fsync)
+
+    def sync(self):
+        """将已写入的数据刷到磁盘"""
+        if os.path.exists(self.path):
+            with open(self.path, 'ab') as f:
+                os.fsync(f.fileno())
+
+    def iter_logs(self, date=None):
+        """按写入顺序遍历日志，可只返回指定日期（YYYY-MM-DD）的日志"""
+        logs = self._iter_records()
+        if date:
+            logs = (log for log in logs if _date_matches(log, date))
+        return logs
+
+    def read_logs(self, date=None):
+        """读取日志，按时间倒序排列"""
+        logs = list(self.iter_logs(date))
+        logs.sort(key=_sort_key, reverse=True)
+        return logs
+
+    def count(self, date=None):
+        """统计日志条数"""
+        return sum(1 for _ in self.iter_logs(date))
+
+    def read_since(self, cursor=None):
+        """增量读取：返回 (cursor之后的新日志, 新cursor, 是否重置)
+
+        JSON数组文件无法增量读取，文件发生变化时重新读取全部日志并返回重置标记。
+        """
+        signature = _file_signature(self.path)
+        if cursor is not None and signature == cursor:
+            return [], cursor, False
+        return list(self._iter_records()), signature, True
+
+    def query(self, date=None, device_type=None, platform=None, ip_prefix=None):
+        """按日期（YYYY-MM-DD）、设备类型、平台、IP前缀筛选日志，按时间倒序返回"""
+        logs = self.iter_logs(date)
+        if device_type:
+            logs = (log for log in logs if log.get('deviceType', 'Unknown') == device_type)
+        if platform:
+            logs = (log for log in logs if detect_platform(log) == platform)
+        if ip_prefix:
+            logs = (log for log in logs if log.get('public_ip', '').startswith(ip_prefix))
+        return sorted(logs, key=_sort_key, reverse=True)
+
+    def replace_all(self, logs):
+        """用给定日志整体替换文件内容"""
+        with file_lock(self.path):
+            self._write_atomic(list(logs))
+
+    def delete(self, entries):
+        """删除与entries内容相同的日志（每条只删除一次），返回删除的条数
+
+        在文件锁内重新读取当前文件，其他进程在此期间写入的日志不会丢失。
+        """
+        with file_lock(self.path):
+            kept, deleted = _remove_matching(self._load_for_update(), entries)
+            if deleted:
+                self._write_atomic(kept)
+        return deleted
+
+    def rewrite(self, func):
+        """对每条日志调用func（原地修改，返回是否修改），有修改时原子重写文件，返回修改的条数"""
+        with file_lock(self.path):
+            logs = self._load_for_update()
+            changed = sum(1 for log in logs if func(log))
+            if changed:
+                self._write_atomic(logs)
+        return changed
+
+
+class JsonlLogStore(JsonArrayLogStore):
+    """JSON Lines追加写入存储"""
+    format = 'jsonl'
+
+    def append(self, entry):
+        """追加一条日志，只写入一行，与文件大小无关"""
+        self.append_many([entry])
+
+    def append_many(self, entries, fsync=False):
+        """批量追加日志，在文件锁内一次写入所有行"""
+        with file_lock(self.path):
+            _append_jsonl_file(self.path, entries, fsync)
+
+    def _iter_records(self):
+        """逐行流式读取日志"""
+        return _iter_jsonl_file(self.path)
+
+    def read_since(self, cursor=None):
+        """从上次读取到的字节偏移继续读取新追加的日志"""
+        return _tail_jsonl_file(self.path, cursor)
+
+    def _write_atomic(self, logs, fsync=False):
+        """按时间正序重写全部日志"""
+        _write_jsonl_file(self.path, logs, fsync)
+
+    def _load_for_update(self):
+        """在持有文件锁时读取现有日志"""
+        return list(self._iter_records())
+
+
+class SqliteLogStore:
+    """SQLite存储，WAL模式下读取与Flask进程的写入互不阻塞
+
+    原始记录以JSON保存在data列，timestamp、public_ip、device_type、platform
+    单独成列并建立索引，筛选查询走索引而不是全量扫描。
+    """
+    format = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL DEFAULT '',
+                    public_ip TEXT NOT NULL DEFAULT '',
+                    device_type TEXT NOT NULL DEFAULT '',
+                    platform TEXT NOT NULL DEFAULT '',
+                    data TEXT NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs (timestamp)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_public_ip ON logs (public_ip)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_device_type ON logs (device_type, timestamp)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_platform ON logs (platform, timestamp)')
+            # generation在删除/重写记录时递增，增量读取方据此判断是否需要重新加载
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    def _connect(self):
+        """获取当前线程的数据库连接（sqlite3连接不能跨线程共享）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(entry):
+        """将日志记录转换为数据库行"""
+        return (
+            str(entry.get('timestamp', '')),
+            str(entry.get('public_ip', '')),
+            str(entry.get('deviceType', 'Unknown')),
+            detect_platform(entry),
+            json.dumps(entry, ensure_ascii=False),
+        )
+
+    def append(self, entry):
+        """插入一条日志"""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO logs (timestamp, public_ip, device_type, platform, data) VALUES (?, ?, ?, ?, ?)',
+                self._row(entry)
+            )
+
+    def append_many(self, entries, fsync=False):
+        """在一个事务内批量插入日志，fsync为True时提交前同步WAL到磁盘"""
+        conn = self._connect()
+        conn.execute('PRAGMA synchronous=FULL' if fsync else 'PRAGMA synchronous=NORMAL')
+        with conn:
+            conn.executemany(
+                'INSERT INTO logs (timestamp, public_ip, device_type, platform, data) VALUES (?, ?, ?, ?, ?)',
+                (self._row(entry) for entry in entries)
+            )
+
+    def sync(self):
+        """执行WAL检查点，将已提交的数据刷到磁盘"""
+        self._connect().execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+    @staticmethod
+    def _generation(conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _bump_generation(conn):
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) "
+            "VALUES ('generation', COALESCE((SELECT value FROM meta WHERE key = 'generation'), 0) + 1)"
+        )
+
+    @staticmethod
+    def _date_condition(date):
+        """指定日期的timestamp范围条件，可以使用timestamp索引"""
+        next_day = (datetime.strptime(date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        return 'timestamp >= ? AND timestamp < ?', [date, next_day]
+
+    def iter_logs(self, date=None):
+        """按写入顺序遍历日志，可只返回指定日期（YYYY-MM-DD）的日志"""
+        sql = 'SELECT data FROM logs'
+        params = []
+        if date:
+            condition, params = self._date_condition(date)
+            sql += ' WHERE ' + condition
+        for (data,) in self._connect().execute(sql + ' ORDER BY id', params):
+            yield json.loads(data)
+
+    def read_logs(self, date=None):
+        """读取日志，按时间倒序排列（走timestamp索引）"""
+        return self.query(date=date)
+
+    def count(self, date=None):
+        """统计日志条数"""
+        sql = 'SELECT COUNT(*) FROM logs'
+        params = []
+        if date:
+            condition, params = self._date_condition(date)
+            sql += ' WHERE ' + condition
+        return self._connect().execute(sql, params).fetchone()[0]
+
+    def read_since(self, cursor=None):
+        """增量读取：返回id大于上次读取位置的新日志；记录被删除/重写过时返回全部日志并标记重置"""
+        conn = self._connect()
+        conn.execute('BEGIN')
+        try:
+            generation = self._generation(conn)
+            reset = cursor is None or cursor[0] != generation
+            last_id = 0 if reset else cursor[1]
+            rows = conn.execute('SELECT id, data FROM logs WHERE id > ? ORDER BY id', (last_id,)).fetchall()
+        finally:
+            conn.execute('COMMIT')
+        if rows:
+            last_id = rows[-1][0]
+        return [json.loads(data) for _, data in rows], (generation, last_id), reset
+
+    def query(self, date=None, device_type=None, platform=None, ip_prefix=None):
+        """按日期（YYYY-MM-DD）、设备类型、平台、IP前缀筛选日志，按时间倒序返回"""
+        conditions = []
+        params = []
+        if date:
+            condition, date_params = self._date_condition(date)
+            conditions.append(condition)
+            params += date_params
+        if device_type:
+            conditions.append('device_type = ?')
+            params.append(device_type)
+        if platform:
+            conditions.append('platform = ?')
+            params.append(platform)
+        if ip_prefix:
+            # 用范围条件代替LIKE，才能使用public_ip索引
+            conditions.append('public_ip >= ? AND public_ip < ?')
+            params += [ip_prefix, _prefix_upper_bound(ip_prefix)]
+
+        sql = 'SELECT data FROM logs'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY timestamp DESC, id DESC'
+        return [json.loads(data) for (data,) in self._connect().execute(sql, params)]
+
+    def replace_all(self, logs):
+        """在一个事务内用给定日志替换全部记录"""
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM logs')
+            self._bump_generation(conn)
+            conn.executemany(
+                'INSERT INTO logs (timestamp, public_ip, device_type, platform, data) VALUES (?, ?, ?, ?, ?)',
+                (self._row(log) for log in sorted(logs, key=_sort_key))
+            )
+
+    def delete(self, entries):
+        """删除与entries内容相同的日志（每条只删除一次），返回删除的条数"""
+        conn = self._connect()
+        deleted = 0
+        with conn:
+            for entry in entries:
+                cursor = conn.execute(
+                    'DELETE FROM logs WHERE id = (SELECT id FROM logs WHERE timestamp = ? AND data = ? LIMIT 1)',
+                    (str(entry.get('timestamp', '')), json.dumps(entry, ensure_ascii=False))
+                )
+                deleted += cursor.rowcount
+            if deleted:
+                self._bump_generation(conn)
+        return deleted
+
+    def rewrite(self, func):
+        """对每条日志调用func（原地修改，返回是否修改），在一个写事务内只更新被修改的行"""
+        conn = self._connect()
+        changed = 0
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for row_id, data in conn.execute('SELECT id, data FROM logs ORDER BY id').fetchall():
+                log = json.loads(data)
+                if not func(log):
+                    continue
+                conn.execute(
+                    'UPDATE logs SET timestamp = ?, public_ip = ?, device_type = ?, platform = ?, data = ? WHERE id = ?',
+                    self._row(log) + (row_id,)
+                )
+                changed += 1
+            if changed:
+                self._bump_generation(conn)
+        return changed
+
+
+class SegmentedLogStore(JsonArrayLogStore):
+    """按天（或按小时）分段的JSON Lines存储
+
+    目录结构：
+        <目录>/manifest.json      分段清单，记录每个分段的时间范围与记录数
+        <目录>/2026-01-10.jsonl   分段文件（按小时分段时为 2026-01-10_19.jsonl）
+
+    按日期读取时只打开对应日期的分段文件，统计条数只需读取清单。
+    """
+    format = 'segments'
+    MANIFEST_FILE = 'manifest.json'
+    UNDATED_SEGMENT = 'undated'
+
+    def __init__(self, path, partition='day'):
+        if partition not in ('day', 'hour'):
+            raise ValueError(f"未知的分段方式: {partition}")
+        self.path = path
+        self.manifest_path = os.path.join(path, self.MANIFEST_FILE)
+        os.makedirs(path, exist_ok=True)
+        # 已有清单时以清单中记录的分段方式为准
+        self.partition = self._load_manifest().get('partition') or partition
+        self._dirty_segments = set()
+
+    def _load_manifest(self):
+        """读取分段清单"""
+        if not os.path.exists(self.manifest_path):
+            return {'partition': getattr(self, 'partition', None), 'segments': {}}
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest, fsync=False):
+        """原子写入分段清单（调用方需持有目录锁）"""
+        manifest['partition'] = self.partition
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, sort_keys=True)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def _segment_key(self, log):
+        """日志所属的分段名"""
+        timestamp = str(log.get('timestamp', ''))
+        if not _TIMESTAMP_RE.match(timestamp):
+            return self.UNDATED_SEGMENT
+        if self.partition == 'hour':
+            return f"{timestamp[:10]}_{timestamp[11:13]}"
+        return timestamp[:10]
+
+    def _segment_path(self, key):
+        return os.path.join(self.path, key + '.jsonl')
+
+    def segments(self, date=None):
+        """按时间顺序返回分段清单中的 (分段名, 分段信息)，可只返回指定日期的分段"""
+        items = sorted(self._load_manifest()['segments'].items())
+        if date:
+            items = [(key, info) for key, info in items if key == date or key.startswith(date + '_')]
+        return items
+
+    @staticmethod
+    def _segment_info(key, logs):
+        """根据分段内的日志重新计算分段信息"""
+        stamps = [str(log.get('timestamp', '')) for log in logs]
+        return {
+            'file': key + '.jsonl',
+            'start': min(stamps) if stamps else '',
+            'end': max(stamps) if stamps else '',
+            'count': len(logs)
+        }
+
+    def _group(self, logs):
+        """按分段名分组"""
+        groups = {}
+        for log in logs:
+            groups.setdefault(self._segment_key(log), []).append(log)
+        return groups
+
+    def append_many(self, entries, fsync=False):
+        """批量追加日志：每个分段追加一次，然后更新清单"""
+        groups = self._group(entries)
+        with file_lock(self.path):
+            manifest = self._load_manifest()
+            for key, group in groups.items():
+                _append_jsonl_file(self._segment_path(key), group, fsync)
+                stamps = [str(log.get('timestamp', '')) for log in group]
+                info = manifest['segments'].get(key)
+                if info is None:
+                    manifest['segments'][key] = self._segment_info(key, group)
+                else:
+                    info['start'] = min([info['start']] + stamps)
+                    info['end'] = max([info['end']] + stamps)
+                    info['count'] += len(group)
+            self._save_manifest(manifest, fsync)
+            self._dirty_segments.update(groups)
+
+    def sync(self):
+        """将最近写入的分段文件和清单刷到磁盘"""
+        dirty, self._dirty_segments = self._dirty_segments, set()
+        for path in [self._segment_path(key) for key in dirty] + [self.manifest_path]:
+            if os.path.exists(path):
+                with open(path, 'ab') as f:
+                    os.fsync(f.fileno())
+
+    def iter_logs(self, date=None):
+        """按时间顺序遍历日志；指定日期时只打开该日期的分段文件"""
+        for key, info in self.segments(date):
+            yield from _iter_jsonl_file(os.path.join(self.path, info['file']))
+
+    def count(self, date=None):
+        """根据清单统计日志条数，不需要读取分段文件"""
+        return sum(info['count'] for _, info in self.segments(date))
+
+    def read_since(self, cursor=None):
+        """增量读取：清单未变化时不读取任何分段，否则只从各分段上次的偏移继续读取"""
+        signature = _file_signature(self.manifest_path)
+        if cursor is not None and cursor['manifest'] == signature:
+            return [], cursor, False
+
+        manifest = self._load_manifest()
+        reset = cursor is None or any(key not in manifest['segments'] for key in cursor['segments'])
+        states = {} if reset else dict(cursor['segments'])
+        records = []
+        for key, info in sorted(manifest['segments'].items()):
+            new_records, state, segment_reset = _tail_jsonl_file(os.path.join(self.path, info['file']), states.get(key))
+            if segment_reset and key in states:
+                # 已读过的分段被重写（删除了记录），整体重新读取
+                return self.read_since(None)
+            records.extend(new_records)
+            states[key] = state
+        return records, {'manifest': signature, 'segments': states}, reset
+
+    def replace_all(self, logs):
+        """用给定日志重写全部分段"""
+        groups = self._group(logs)
+        with file_lock(self.path):
+            manifest = self._load_manifest()
+            for key, info in manifest['segments'].items():
+                if key not in groups:
+                    os.remove(os.path.join(self.path, info['file']))
+            manifest['segments'] = {}
+            for key, group in groups.items():
+                _write_jsonl_file(self._segment_path(key), group)
+                manifest['segments'][key] = self._segment_info(key, group)
+            self._save_manifest(manifest)
+
+    def delete(self, entries):
+        """删除与entries内容相同的日志，只重写涉及到的分段"""
+        groups = self._group(entries)
+        deleted = 0
+        with file_lock(self.path):
+            manifest = self._load_manifest()
+            for key, group in groups.items():
+                info = manifest['segments'].get(key)
+                if info is None:
+                    continue
+                segment_path = os.path.join(self.path, info['file'])
+                kept, removed = _remove_matching(_iter_jsonl_file(segment_path), group)
+                if not removed:
+                    continue
+                deleted += removed
+                if kept:
+                    _write_jsonl_file(segment_path, kept)
+                    manifest['segments'][key] = self._segment_info(key, kept)
+                else:
+                    os.remove(segment_path)
+                    del manifest['segments'][key]
+            if deleted:
+                self._save_manifest(manifest)
+        return deleted
+
+    def rewrite(self, func):
+        """对每条日志调用func（原地修改，返回是否修改），只重写有修改的分段"""
+        changed = 0
+        with file_lock(self.path):
+            manifest = self._load_manifest()
+            for key, info in sorted(manifest['segments'].items()):
+                segment_path = os.path.join(self.path, info['file'])
+                logs = list(_iter_jsonl_file(segment_path))
+                segment_changed = sum(1 for log in logs if func(log))
+                if segment_changed:
+                    _write_jsonl_file(segment_path, logs)
+                    changed += segment_changed
+            if changed:
+                # 重新保存清单，让增量读取方发现分段已被重写
+                self._save_manifest(manifest)
+        return changed
+
+
+def open_log_store(path):
+    """根据扩展名或文件内容选择对应的存储"""
+    if os.path.isdir(path):
+        return SegmentedLogStore(path)
+    if os.path.basename(path) == SegmentedLogStore.MANIFEST_FILE:
+        return SegmentedLogStore(os.path.dirname(path))
+    if path.endswith('.db') or path.endswith('.sqlite'):
+        return SqliteLogStore(path)
+    if path.endswith('.jsonl') or detect_log_format(path) == 'jsonl':
+        return JsonlLogStore(path)
+    return JsonArrayLogStore(path)
+
+
+def backfill_derived_fields(store, force=False):
+    """为没有派生字段的历史日志补充派生字段，返回补充的条数"""
+    return store.rewrite(lambda log: add_derived_fields(log, force))
+
+
+def migration_marker(dst_store):
+    """迁移完成标记文件的路径（<目标存储>.migrated）"""
+    return dst_store.path.rstrip('/\\') + '.migrated'
+
+
+def migrate_logs(src, dst_store, force=False):
+    """将src文件中的日志一次性导入dst_store，返回迁移的记录数
+
+    源文件保持不变。迁移成功或目标存储已有记录时写入标记文件，之后不再迁移，
+    即使目标存储的记录后来被全部删除，也不会重新导入旧日志；force为True时忽略标记文件。
+    检查与写入在同一把文件锁内完成，多个工作进程同时启动时只会迁移一次。
+    """
+    marker = migration_marker(dst_store)
+    with file_lock(dst_store.path):
+        if not force and os.path.exists(marker):
+            return 0
+        if next(iter(dst_store.iter_logs()), None) is not None:
+            logs = []
+        else:
+            logs = list(open_log_store(src).iter_logs())
+            if not logs:
+                return 0
+            dst_store.replace_all(logs)
+        with open(marker, 'w', encoding='utf-8') as f:
+            f.write(f"{src} {len(logs)} {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        return len(logs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='日志存储维护工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    migrate_parser = subparsers.add_parser('migrate', help='迁移日志到其他格式（按目标扩展名选择：.jsonl/.db）')
+    migrate_parser.add_argument('src', nargs='?', default='device_info.json')
+    migrate_parser.add_argument('dst', nargs='?', default='device_info.jsonl')
+    migrate_parser.add_argument('--force', action='store_true', help='忽略迁移完成标记，目标存储为空时重新迁移')
+
+    backfill_parser = subparsers.add_parser('backfill', help='为历史日志补充派生字段（GCJ-02坐标、地图链接、平台、时间戳）')
+    backfill_parser.add_argument('path', nargs='?', default='device_info.jsonl')
+    backfill_parser.add_argument('--force', action='store_true', help='重新计算已有的派生字段')
+
+    args = parser.parse_args()
+    if args.command == 'migrate':
+        count = migrate_logs(args.src, open_log_store(args.dst), args.force)
+        print(f"已迁移 {count} 条记录: {args.src} -> {args.dst}")
+    elif args.command == 'backfill':
+        count = backfill_derived_fields(open_log_store(args.path), args.force)
+        print(f"已为 {count} 条记录补充派生字段: {args.path}")
@@ -1,5 +1,4 @@
 import sys
-import json
 import os
 import time
 import subprocess
@@ -15,6 +14,8 @@ from PyQt5.QtCore import (
     QUrl, QTimer
 )
 from PyQt5.QtGui import QFont, QColor, QPalette, QDesktopServices
+from log_store import open_log_store, detect_platform
+from coord_transform import amap_marker_url
 
 class LogModel(QAbstractTableModel):
     """日志数据模型"""
@@ -52,24 +53,8 @@ class LogModel(QAbstractTableModel):
             elif column == 4:  # 操作系统
                 return log.get('os', 'N/A')
             elif column == 5:  # 平台
-                # 根据操作系统推断平台
-                os_name = log.get('os', '').lower()
-                platform = log.get('platform', '').lower()
-                
-                if 'ios' in os_name or 'iphone' in os_name or 'ipad' in os_name:
-                    return 'iOS'
-                elif 'android' in os_name:
-                    return 'Android'
-                elif 'mac' in os_name or 'macos' in os_name:
-                    return 'macOS'
-                elif 'win' in os_name or 'windows' in os_name:
-                    return 'Windows'
-                elif 'linux' in os_name:
-                    return 'Linux'
-                elif platform:
-                    return platform.capitalize()
-                else:
-                    return 'Unknown'
+                # 写入时已计算的规范化平台，历史日志根据操作系统推断
+                return log.get('platform_name') or detect_platform(log)
             elif column == 6:  # 经纬度
                 lat = log.get('latitude', 'N/A')
                 lng = log.get('longitude', 'N/A')
@@ -115,7 +100,13 @@ class LogViewer(QMainWindow):
         super().__init__()
         self.setWindowTitle("设备信息日志查看器")
         self.setGeometry(100, 100, 1200, 800)
-        self.log_file = "device_info.json"
+        # 与app.py使用相同的LOG_FORMAT环境变量选择日志文件，不存在时回退到旧版JSON数组文件
+        log_format = os.environ.get('LOG_FORMAT', 'jsonl')
+        self.log_file = {
+            "sqlite": "device_info.db", "jsonl": "device_info.jsonl", "segments": "device_info_segments"
+        }.get(log_format, "device_info.json")
+        if not os.path.exists(self.log_file):
+            self.log_file = "device_info.json"
         self.logs = []
         
         # 网站管理相关属性
@@ -303,7 +294,7 @@ class LogViewer(QMainWindow):
         # IP地址搜索
         search_layout.addWidget(QLabel("IP地址:"), 0, 0)
         self.ip_search = QLineEdit()
-        self.ip_search.setPlaceholderText("输入IP地址搜索")
+        self.ip_search.setPlaceholderText("输入IP地址前缀搜索")
         search_layout.addWidget(self.ip_search, 0, 1)
         
         # 设备类型筛选
@@ -457,11 +448,8 @@ class LogViewer(QMainWindow):
         """加载日志文件"""
         if os.path.exists(self.log_file):
             try:
-                with open(self.log_file, 'r', encoding='utf-8') as f:
-                    self.logs = json.load(f)
-                
-                # 按时间倒序排列
-                self.logs.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+                # 流式读取并按时间倒序排列
+                self.logs = open_log_store(self.log_file).read_logs()
                 
                 # 更新模型数据
                 self.log_model.logs = self.logs
@@ -477,7 +465,7 @@ class LogViewer(QMainWindow):
     def open_file(self):
         """打开日志文件"""
         file_path, _ = QFileDialog.getOpenFileName(
-            self, "打开日志文件", ".", "JSON Files (*.json)"
+            self, "打开日志文件", ".", "Log Files (*.json *.jsonl *.db)"
         )
         if file_path:
             self.log_file = file_path
@@ -485,44 +473,22 @@ class LogViewer(QMainWindow):
     
     def filter_logs(self):
         """筛选日志"""
-        # 获取原始日志数据
-        if os.path.exists(self.log_file):
-            try:
-                with open(self.log_file, 'r', encoding='utf-8') as f:
-                    all_logs = json.load(f)
-            except:
-                all_logs = []
-        else:
-            all_logs = []
-        
-        # 应用筛选条件
-        filtered_logs = all_logs
-        
-        # IP地址筛选
-        ip_filter = self.ip_search.text().strip()
-        if ip_filter:
-            filtered_logs = [log for log in filtered_logs if ip_filter in log.get('public_ip', '')]
-        
-        # 设备类型筛选
+        # 日期、设备类型、平台、IP前缀交给存储层筛选（SQLite存储走索引，分段存储只打开所选日期的分段）
         device_type = self.device_type.currentText()
-        if device_type != "全部":
-            filtered_logs = [
-                log for log in filtered_logs 
-                if log.get('deviceType', 'Unknown') == device_type
-            ]
-        
-        # 平台筛选
         platform = self.platform_filter.currentText()
-        if platform != "全部":
-            # 根据平台名称筛选日志
-            filtered_logs = [
-                log for log in filtered_logs
-                if self.get_platform(log) == platform
-            ]
-        
-        # 日期筛选
-        selected_date = self.date_edit.date().toString("yyyy-MM-dd")
-        filtered_logs = [log for log in filtered_logs if log.get('timestamp', '').startswith(selected_date)]
+        error = None
+        try:
+            filtered_logs = open_log_store(self.log_file).query(
+                date=self.date_edit.date().toString("yyyy-MM-dd"),
+                device_type=device_type if device_type != "全部" else None,
+                platform=platform if platform != "全部" else None,
+                ip_prefix=self.ip_search.text().strip() or None
+            )
+        except Exception as e:
+            # 筛选随输入实时触发，错误显示在状态栏，不弹窗打断输入
+            error = f"筛选日志失败: {str(e)}"
+            print(error)
+            filtered_logs = []
         
         # 时间筛选
         time_range = self.time_edit.currentText()
@@ -536,15 +502,12 @@ class LogViewer(QMainWindow):
                 if self.is_time_in_range(log.get('timestamp', ''), start_hour, start_min, end_hour, end_min)
             ]
         
-        # 按时间倒序排列
-        filtered_logs.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-        
         # 更新模型数据
         self.log_model.logs = filtered_logs
         self.log_model.layoutChanged.emit()
         
         # 更新状态栏
-        self.status_label.setText(f"已筛选 {len(filtered_logs)} 条记录")
+        self.status_label.setText(error or f"已筛选 {len(filtered_logs)} 条记录")
     
     def is_time_in_range(self, timestamp, start_hour, start_min, end_hour, end_min):
         """检查时间是否在指定范围内"""
@@ -574,23 +537,7 @@ class LogViewer(QMainWindow):
     
     def get_platform(self, log):
         """根据日志记录的操作系统信息推断平台"""
-        os_name = log.get('os', '').lower()
-        platform = log.get('platform', '').lower()
-        
-        if 'ios' in os_name or 'iphone' in os_name or 'ipad' in os_name:
-            return 'iOS'
-        elif 'android' in os_name:
-            return 'Android'
-        elif 'mac' in os_name or 'macos' in os_name:
-            return 'macOS'
-        elif 'win' in os_name or 'windows' in os_name:
-            return 'Windows'
-        elif 'linux' in os_name:
-            return 'Linux'
-        elif platform:
-            return platform.capitalize()
-        else:
-            return 'Unknown'
+        return log.get('platform_name') or detect_platform(log)
     
     def delete_selected(self):
         """删除选中的记录"""
@@ -612,16 +559,11 @@ class LogViewer(QMainWindow):
             # 获取选中行的原始索引
             source_indices = [self.proxy_model.mapToSource(index) for index in selected_rows]
             source_rows = sorted([index.row() for index in source_indices], reverse=True)
+            deleted_logs = [self.log_model.logs[row] for row in source_rows if 0 <= row < len(self.log_model.logs)]
             
-            # 删除原始日志中的记录
-            for row in source_rows:
-                if 0 <= row < len(self.logs):
-                    del self.logs[row]
-            
-            # 保存更新后的日志 - 使用非阻塞方式
+            # 按内容从日志文件中删除，文件锁保证网站进程同时写入的新日志不会丢失
             try:
-                with open(self.log_file, 'w', encoding='utf-8') as f:
-                    json.dump(self.logs, f, ensure_ascii=False, indent=2)
+                open_log_store(self.log_file).delete(deleted_logs)
             except Exception as file_error:
                 QMessageBox.critical(self, "错误", f"保存日志文件失败: {str(file_error)}")
                 return
@@ -629,8 +571,12 @@ class LogViewer(QMainWindow):
             # 使用正确的模型更新方式
             # beginResetModel() 和 endResetModel() 会完全重置模型，解决索引问题
             self.log_model.beginResetModel()
-            # 直接更新模型的日志列表，不需要使用副本
-            self.log_model.logs = self.logs
+            # 删除当前显示列表中的记录；筛选状态下同时更新完整日志列表
+            for row in source_rows:
+                if 0 <= row < len(self.log_model.logs):
+                    del self.log_model.logs[row]
+            if self.logs is not self.log_model.logs:
+                self.logs = [log for log in self.logs if log not in deleted_logs]
             self.log_model.endResetModel()
             
             # 代理模型会自动更新，不需要手动调用invalidateFilter或layoutChanged
@@ -656,14 +602,8 @@ class LogViewer(QMainWindow):
             lat = log.get('latitude', 'N/A')
             lng = log.get('longitude', 'N/A')
             if lat != 'N/A' and lng != 'N/A':
-                try:
-                    wgs_lng = float(lng)
-                    wgs_lat = float(lat)
-                    # 转换为GCJ-02坐标
-                    gcj_lng, gcj_lat = self.wgs84_to_gcj02(wgs_lng, wgs_lat)
-                    map_url = f"https://uri.amap.com/marker?position={gcj_lng:.6f},{gcj_lat:.6f}&name=当前位置&coordinate=gaode"
-                except:
-                    map_url = f"https://uri.amap.com/marker?position={lng},{lat}&name=当前位置&coordinate=gaode"
+                # 写入时已生成的高德地图链接，历史日志现场转换为GCJ-02坐标
+                map_url = log.get('map_url') or amap_marker_url(lat, lng)
                 
                 # 打开浏览器访问高德地图
                 QDesktopServices.openUrl(QUrl(map_url))
@@ -673,50 +613,6 @@ class LogViewer(QMainWindow):
             # 显示详细信息弹窗
             self.show_log_details(log)
     
-    def wgs84_to_gcj02(self, lng, lat):
-        """将WGS-84坐标转换为GCJ-02坐标"""
-        import math
-        PI = math.pi
-        a = 6378137.0
-        ee = 0.00669342162296594323
-        
-        if self.out_of_china(lng, lat):
-            return lng, lat
-        
-        d_lat = self.transform_lat(lng - 105.0, lat - 35.0)
-        d_lng = self.transform_lng(lng - 105.0, lat - 35.0)
-        rad_lat = lat / 180.0 * PI
-        magic = math.sin(rad_lat)
-        magic = 1 - ee * magic * magic
-        sqrt_magic = math.sqrt(magic)
-        d_lat = (d_lat * 180.0) / ((a * (1 - ee)) / (magic * sqrt_magic) * PI)
-        d_lng = (d_lng * 180.0) / (a / sqrt_magic * math.cos(rad_lat) * PI)
-        
-        gcj_lat = lat + d_lat
-        gcj_lng = lng + d_lng
-        
-        return gcj_lng, gcj_lat
-    
-    def transform_lat(self, x, y):
-        """计算纬度偏移量"""
-        import math
-        PI = math.pi
-        ret = -100.0 + 2.0 * x + 3.0 * y + 0.2 * y * y + 0.1 * x * y + 0.2 * math.sqrt(abs(x))
-        ret += (20.0 * math.sin(6.0 * x * PI) + 20.0 * math.sin(2.0 * x * PI)) * 2.0 / 3.0
-        ret += (20.0 * math.sin(y * PI) + 40.0 * math.sin(y / 3.0 * PI)) * 2.0 / 3.0
-        ret += (160.0 * math.sin(y / 12.0 * PI) + 320 * math.sin(y * PI / 30.0)) * 2.0 / 3.0
-        return ret
-    
-    def transform_lng(self, x, y):
-        """计算经度偏移量"""
-        import math
-        PI = math.pi
-        ret = 300.0 + x + 2.0 * y + 0.1 * x * x + 0.1 * x * y + 0.1 * math.sqrt(abs(x))
-        ret += (20.0 * math.sin(6.0 * x * PI) + 20.0 * math.sin(2.0 * x * PI)) * 2.0 / 3.0
-        ret += (20.0 * math.sin(x * PI) + 40.0 * math.sin(x / 3.0 * PI)) * 2.0 / 3.0
-        ret += (150.0 * math.sin(x / 12.0 * PI) + 300.0 * math.sin(x / 30.0 * PI)) * 2.0 / 3.0
-        return ret
-    
     def toggle_website(self):
         """切换网站运行状态"""
         if not self.website_running:
@@ -1184,10 +1080,6 @@ class LogViewer(QMainWindow):
             QMessageBox.critical(self, "错误", f"导出失败: {str(e)}")
             self.status_label.setText(f"导出失败: {str(e)}")
     
-    def out_of_china(self, lng, lat):
-        """判断坐标是否在国外"""
-        return (lng < 72.004 or lng > 137.8347) or (lat < 0.8293 or lat > 55.8271)
-    
     def closeEvent(self, event):
         """窗口关闭事件，确保结束后台网站进程"""
         # 停止网站进程
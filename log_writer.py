@@ -0,0 +1,169 @@
+"""后台批量写入：请求线程只负责入队，由单独的写入线程按批次落盘
+
+durability（落盘策略）：
+- batch：每个批次写入后立即fsync
+- interval：每隔fsync_interval秒fsync一次
+- none：不主动fsync，交给操作系统
+
+写入失败（例如SQLite在超时后仍为database is locked）时保留该批次，按指数退避重试，
+重试max_retries次仍失败才丢弃，丢弃的条数记在dropped中。
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_POLICIES = ('batch', 'interval', 'none')
+
+_STOP = object()
+
+
+class BatchLogWriter:
+    """有界队列 + 后台线程的分组提交写入器"""
+
+    def __init__(self, store, max_queue=10000, batch_size=200, flush_interval=0.2,
+                 durability='interval', fsync_interval=1.0, enqueue_timeout=0.05, on_flush=None,
+                 max_retries=5, retry_backoff=0.5, max_retry_backoff=10.0):
+        if durability not in DURABILITY_POLICIES:
+            raise ValueError(f"未知的落盘策略: {durability}")
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.fsync_interval = fsync_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.on_flush = on_flush  # 每个批次写入成功后以该批次调用
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff  # 首次重试前等待的秒数，之后每次加倍
+        self.max_retry_backoff = max_retry_backoff
+        self.dropped = 0  # 重试后仍写入失败而丢弃的日志条数
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None  # 启动写入线程的进程，fork出的子进程中需要重新启动
+        self._start_lock = threading.Lock()
+        self._last_sync = time.monotonic()
+        self._dirty = False
+        self._closed = False
+
+    def start(self):
+        """启动后台写入线程；在fork出的子进程（例如gunicorn --preload的工作进程）中调用时为该进程重新启动"""
+        with self._start_lock:
+            if self._pid != os.getpid():
+                if self._pid is not None:
+                    # 父进程的写入线程不会随fork复制，队列中的日志由父进程负责写入
+                    self._queue = queue.Queue(maxsize=self.max_queue)
+                    self._dirty = False
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, entry):
+        """将日志放入队列（首次提交时启动写入线程），队列已满（超过enqueue_timeout仍无空位）时返回False"""
+        if self._closed:
+            return False
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self._queue.put(entry, timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            logger.error("日志写入队列已满，丢弃一条日志")
+            return False
+
+    def close(self, timeout=10):
+        """停止接收新日志，等待队列中的日志全部落盘"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"日志写入线程未能在 {timeout} 秒内退出，剩余约 {self._queue.qsize()} 条日志未写入")
+
+    def _run(self):
+        """写入线程主循环：凑满batch_size或等待flush_interval后写入一个批次"""
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                self._maybe_sync()
+                continue
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+
+        # 退出前写完队列中剩余的日志
+        remaining = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                remaining.append(item)
+        for start in range(0, len(remaining), self.batch_size):
+            self._flush(remaining[start:start + self.batch_size])
+        if self.durability != 'none' and self._dirty:
+            self._sync()
+
+    def _flush(self, batch):
+        """写入一个批次，失败时按指数退避重试，期间不再从队列取新的日志"""
+        attempt = 0
+        while True:
+            try:
+                self.store.append_many(batch, fsync=self.durability == 'batch')
+                break
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    self.dropped += len(batch)
+                    logger.error(f"批量写入 {len(batch)} 条日志失败，已重试 {attempt} 次，丢弃该批次（累计丢弃 {self.dropped} 条）: {e}")
+                    return
+                delay = min(self.retry_backoff * 2 ** attempt, self.max_retry_backoff)
+                attempt += 1
+                logger.warning(f"批量写入 {len(batch)} 条日志失败，{delay} 秒后第 {attempt} 次重试: {e}")
+                time.sleep(delay)
+        self._dirty = self.durability != 'batch'
+        if self.on_flush is not None:
+            try:
+                self.on_flush(batch)
+            except Exception as e:
+                logger.error(f"写入回调执行失败: {e}")
+        self._maybe_sync()
+
+    def _maybe_sync(self):
+        """interval策略下，距上次fsync超过fsync_interval时执行一次fsync"""
+        if self.durability == 'interval' and self._dirty and time.monotonic() - self._last_sync >= self.fsync_interval:
+            self._sync()
+
+    def _sync(self):
+        """fsync已写入的数据"""
+        try:
+            self.store.sync()
+        except Exception as e:
+            logger.error(f"日志fsync失败: {e}")
+        self._dirty = False
+        self._last_sync = time.monotonic()
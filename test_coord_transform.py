@@ -0,0 +1,57 @@
+"""坐标批量转换的检查脚本：随机生成国内外的坐标，核对NumPy向量化的wgs84_to_gcj02_batch与
+逐点计算的wgs84_to_gcj02结果相差不超过1e-9度；未安装NumPy时跳过
+
+运行：python test_coord_transform.py
+"""
+import random
+
+import coord_transform
+from coord_transform import wgs84_to_gcj02, wgs84_to_gcj02_batch
+
+TOLERANCE = 1e-9  # 允许的最大误差（度）
+COUNT = 100000
+
+
+def sample_points(count=COUNT, seed=20240101):
+    """随机坐标：一半在国内范围（含边界附近），一半分布在全球"""
+    rng = random.Random(seed)
+    lngs = []
+    lats = []
+    for i in range(count):
+        if i % 2:
+            lngs.append(rng.uniform(-180.0, 180.0))
+            lats.append(rng.uniform(-90.0, 90.0))
+        else:
+            lngs.append(rng.uniform(71.9, 137.9))
+            lats.append(rng.uniform(0.7, 55.9))
+    # 国内范围的边界和常见城市
+    lngs += [72.004, 137.8347, 72.0039, 137.8348, 121.4737, 116.4074, 105.0]
+    lats += [0.8293, 55.8271, 0.8292, 55.8272, 31.2304, 39.9042, 35.0]
+    return lngs, lats
+
+
+def max_batch_error():
+    """返回向量化计算与逐点计算的最大误差（度）"""
+    lngs, lats = sample_points()
+    batch_lngs, batch_lats = wgs84_to_gcj02_batch(lngs, lats)
+    error = 0.0
+    for lng, lat, batch_lng, batch_lat in zip(lngs, lats, batch_lngs, batch_lats):
+        gcj_lng, gcj_lat = wgs84_to_gcj02(lng, lat)
+        error = max(error, abs(gcj_lng - float(batch_lng)), abs(gcj_lat - float(batch_lat)))
+    return error
+
+
+def test_batch_matches_scalar():
+    if coord_transform.np is None:
+        import pytest
+        pytest.skip('未安装NumPy')
+    assert max_batch_error() <= TOLERANCE
+
+
+if __name__ == '__main__':
+    if coord_transform.np is None:
+        print("[*] 未安装NumPy，跳过向量化计算的检查")
+        raise SystemExit(0)
+    error = max_batch_error()
+    print(f"[{'+' if error <= TOLERANCE else '-'}] {COUNT} 个坐标的最大误差: {error:.3e} 度（允许 {TOLERANCE:g}）")
+    raise SystemExit(0 if error <= TOLERANCE else 1)
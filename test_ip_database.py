@@ -0,0 +1,79 @@
+"""离线IP数据库的检查脚本：用ip_ranges_sample.csv生成临时数据库，核对IPv4、IPv6、IPv4映射地址、
+表头和地址段边界的查询结果
+
+运行：python test_ip_database.py
+"""
+import os
+import tempfile
+
+from ip_database import IPRangeDatabase, build_ip_database
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ip_ranges_sample.csv')
+
+# (IP, 预期的city，None表示不在任何地址段内)
+CASES = [
+    # IPv4地址段的起点、终点和两侧相邻地址
+    ('0.255.255.255', None),
+    ('1.0.0.0', '布里斯班'),
+    ('1.0.0.255', '布里斯班'),
+    ('1.0.1.0', '福州'),
+    ('1.0.3.255', '福州'),
+    ('1.0.4.0', None),
+    ('36.100.1.1', '北京'),
+    ('36.95.255.255', None),
+    ('36.128.0.0', None),
+    # 整数格式的地址段（36.0.0.0 - 36.0.15.255）
+    ('36.0.0.0', '上海'),
+    ('36.0.15.255', '上海'),
+    ('36.0.16.0', None),
+    # 最后一个IPv4地址段，空字段返回N/A
+    ('223.255.255.255', 'N/A'),
+    # IPv6
+    ('2001:db8::', 'N/A'),
+    ('2001:db8::ffff', 'N/A'),
+    ('2001:db8::1:0', None),
+    ('2400:3200::1', '杭州'),
+    ('2400:3201::', None),
+    ('::', None),
+    # IPv4映射的IPv6地址按IPv4地址查询
+    ('::ffff:1.0.1.1', '福州'),
+    ('::ffff:1.0.4.0', None),
+    # 无效地址
+    ('not-an-ip', None),
+    ('', None),
+]
+
+
+def check_sample_database():
+    """逐条核对CASES，返回不符合预期的结果列表"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'ip_ranges.db')
+        count = build_ip_database(SAMPLE_CSV, db_path)
+        # 表头和注释行不计入地址段
+        assert count == 7, f"导入的地址段数为 {count}，预期为 7"
+        db = IPRangeDatabase(db_path)
+        try:
+            assert db.size == count
+            failures = []
+            for ip, city in CASES:
+                result = db.lookup(ip)
+                actual = result['city'] if result is not None else None
+                if actual != city:
+                    failures.append((ip, city, actual))
+            mapped = db.lookup('::ffff:1.0.1.1')
+            assert mapped['ip'] == '::ffff:1.0.1.1' and mapped['loc'] == '26.0614,119.3061' and mapped['isp'] == '中国电信'
+            return failures
+        finally:
+            db.close()
+
+
+def test_sample_database():
+    assert check_sample_database() == []
+
+
+if __name__ == '__main__':
+    failures = check_sample_database()
+    for ip, expected, actual in failures:
+        print(f"[-] {ip}: 预期 {expected}，实际 {actual}")
+    print(f"[+] 共 {len(CASES)} 项，{len(CASES) - len(failures)} 项通过")
+    raise SystemExit(1 if failures else 0)